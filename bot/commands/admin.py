@@ -2,6 +2,7 @@ import asyncio
 import discord
 from discord.ext import commands
 from bot.config import WormholeConfig
+from bot.features.embed import create_embed
 
 def is_wormhole_admin():
     async def predicate(ctx):
@@ -126,5 +127,80 @@ class AdminCommands(commands.Cog):
         tasks = [send_to_channel(channel) for channel in await self.config.get_channels_by_category(channelName)]
         await asyncio.gather(*tasks)
 
+    @commands.command(name="coalesce")
+    @is_wormhole_admin()
+    async def set_coalesce(self, ctx, channelName: str, windowMs: int):
+        """Merge bursts of messages from one author in a channel into one post (0 to disable)"""
+        if windowMs < 0 or windowMs > 10000:
+            await ctx.send("The coalescing window must be between 0 and 10000 ms")
+            return
+
+        updated = await self.config.set_category_coalesce(channelName, windowMs)
+        if not updated:
+            await ctx.send(f"Channel {channelName} has no joined channels")
+        elif windowMs:
+            await ctx.send(f"Coalescing messages in {channelName} within {windowMs} ms")
+        else:
+            await ctx.send(f"Disabled coalescing in {channelName}")
+
+    @commands.command(name="cache_stats")
+    @is_wormhole_admin()
+    async def cache_stats(self, ctx):
+        """Show hit/miss counters for the in-memory caches"""
+        embed = create_embed(title="Cache Stats", description="")
+        for name, stats in self.config.get_cache_stats().items():
+            embed.add_field(
+                name=name,
+                value=f"Size: {stats['size']}/{stats['max_size']}\n"
+                      f"Hits: {stats['hits']}\n"
+                      f"Misses: {stats['misses']}\n"
+                      f"Hit rate: {stats['hit_rate']:.1%}",
+                inline=True
+            )
+        permissions = self.bot.permissions.stats()
+        embed.add_field(
+            name="permissions",
+            value=f"Channels: {permissions['size']}\n"
+                  f"Hits: {permissions['hits']}\n"
+                  f"Misses: {permissions['misses']}",
+            inline=True
+        )
+        dispatch = self.bot.dispatcher.stats()
+        embed.add_field(
+            name="dispatcher",
+            value=f"Destinations: {dispatch['destinations']}\n"
+                  f"Queued: {dispatch['queued']}\n"
+                  f"Sent: {dispatch['sent']}\n"
+                  f"Failed: {dispatch['failed']} ({dispatch['rate_limited']} rate limited)",
+            inline=True
+        )
+        for queue in (self.bot.bookkeeping, self.bot.reactions):
+            stats = queue.stats()
+            embed.add_field(
+                name=queue.name,
+                value=f"Queued: {stats['queued']}/{stats['max_size']}\n"
+                      f"Processed: {stats['processed']}\n"
+                      f"Failed: {stats['failed']}\n"
+                      f"Dropped: {stats['dropped']}",
+                inline=True
+            )
+        for name, stats in self.bot.bridge_bus.stats().items():
+            embed.add_field(
+                name=name,
+                value=f"Queued: {stats['queued']}\n"
+                      f"Sent: {stats['sent']} in {stats['batches']} batches\n"
+                      f"Failed: {stats['failed']}\n"
+                      f"Dropped: {stats['dropped']}",
+                inline=True
+            )
+        inbound = self.bot.ssh_chat_batcher.stats()
+        embed.add_field(
+            name="ssh-chat inbound",
+            value=f"Pending: {inbound['pending']}\n"
+                  f"Lines: {inbound['lines']} in {inbound['batches']} batches",
+            inline=True
+        )
+        await ctx.send(embed=embed)
+
 async def setup(bot):
     await bot.add_cog(AdminCommands(bot))
\ No newline at end of file
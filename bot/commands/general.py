@@ -108,13 +108,21 @@ class GeneralCommands(commands.Cog):
     @commands.command(name="list_servers")
     async def list_servers(self, ctx):
         """List servers the bot is in"""
-        servers = [f"- {guild.name}" for guild in self.bot.guilds]
-        total = len(servers)
-        disconnected_channels = [f"- {channel}" for channel in self.bot.disconnected_channels]
+        servers = "\n".join(f"- {guild.name}" for guild in self.bot.guilds)
+        total = len(self.bot.guilds)
+
+        unhealthy = []
+        for breaker in self.bot.dispatcher.breakers.summary():
+            channel = self.bot.get_channel(int(breaker["key"]))
+            name = f"{channel.name} in {channel.guild.name}" if channel else breaker["key"]
+            retry = f", retry in {breaker['retry_in']:.0f}s" if breaker["retry_in"] else ""
+            unhealthy.append(f"- {name}: {breaker['state']} ({breaker['failures']} failures{retry})")
+        unhealthy = "\n".join(unhealthy) or "- None"
+
         await ctx.send(
-                       f"All Servers:\n{'\n'.join(servers)}"\
-                       f"\nDisconnected Channels:\n{'\n'.join(disconnected_channels)}"\
-                       f"\n---\nTotal Servers: {total}"
+            f"All Servers:\n{servers}"
+            f"\nUnhealthy Channels:\n{unhealthy}"
+            f"\n---\nTotal Servers: {total}"
         )
 
 async def setup(bot):
@@ -1,10 +1,11 @@
 import asyncio
-from datetime import datetime
+from datetime import datetime, timezone
 import hashlib
 import json
+import logging
 import math
 import time
-from typing import Dict, List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Set
 from functools import wraps
 
 import asyncpg
@@ -12,8 +13,17 @@ import dotenv
 import os
 import re
 
+from bot.utils.cache import TTLCache
+
 dotenv.load_dotenv()
 
+HEX_PATTERN = re.compile(r'^[0-9a-f]{1,64}$')
+
+class AmbiguousHashError(Exception):
+    def __init__(self, prefix: str):
+        super().__init__(f"Hash `{prefix}` matches more than one user, please use a longer prefix")
+        self.prefix = prefix
+
 def auto_configure_user(func):
     @wraps(func)
     async def wrapper(self, user_id: str, *args, **kwargs):
@@ -34,19 +44,142 @@ def classify_user_id(user_id):
         else:
             return "Other"
 
+# In-process copy of Channels and ChannelList. WormholeConfig writes keep it current and
+# other replicas are told to reload it through publish_invalidation("routing").
+class RoutingTable:
+    def __init__(self):
+        self.channels: Dict[str, Dict] = {}
+        self.categories: Dict[str, Set[str]] = {}
+        self.channel_list: Set[str] = set()
+        self.loaded = False
+
+    async def load(self, pool) -> None:
+        async with pool.acquire() as conn:
+            channels = await conn.fetch(
+                """
+                SELECT * FROM Channels
+                """
+            )
+            channel_list = await conn.fetch(
+                """
+                SELECT channel_name FROM ChannelList
+                """
+            )
+
+        table = RoutingTable()
+        for channel in channels:
+            table.set_channel(dict(channel))
+        self.channels = table.channels
+        self.categories = table.categories
+        self.channel_list = {channel['channel_name'] for channel in channel_list}
+        self.loaded = True
+
+    def set_channel(self, channel: Dict) -> None:
+        channel_id = channel['channel_id']
+        self.drop_channel(channel_id)
+        self.channels[channel_id] = channel
+        self.categories.setdefault(channel['channel_category'], set()).add(channel_id)
+
+    def drop_channel(self, channel_id: str) -> None:
+        channel = self.channels.pop(channel_id, None)
+        if not channel:
+            return
+        peers = self.categories.get(channel['channel_category'])
+        if peers is not None:
+            peers.discard(channel_id)
+            if not peers:
+                del self.categories[channel['channel_category']]
+
+    def get_channel(self, channel_id: str) -> Optional[Dict]:
+        channel = self.channels.get(channel_id)
+        return dict(channel) if channel else None
+
+    def get_category(self, category: str) -> List[Dict]:
+        return [dict(self.channels[channel_id]) for channel_id in self.categories.get(category, ())]
+
+    def get_category_ids(self, category: str) -> List[str]:
+        return list(self.categories.get(category, ()))
+
+    def get_peers(self, channel_id: str) -> List[str]:
+        channel = self.channels.get(channel_id)
+        if not channel:
+            return []
+        return list(self.categories.get(channel['channel_category'], ()))
+
 class WormholeConfig:
     def __init__(self):
         self.db_url = os.getenv("DATABASE_URL")
         self.global_salt = os.getenv("global_salt") or "else your cluster is compromised"
         self.pool = None
+        self.logger = logging.getLogger('wormhole')
+        self.routing = RoutingTable()
+        self.user_cache = TTLCache(
+            max_size=int(os.getenv("USER_CACHE_SIZE", "50000")),
+            ttl=float(os.getenv("USER_CACHE_TTL", "300"))
+        )
+        self.role_colors: Dict[str, int] = {}
+        self.pending_avatars: Dict[str, str] = {}
+        self.pending_usernames: Set[tuple] = set()
+        self.known_usernames = TTLCache(
+            max_size=int(os.getenv("USER_CACHE_SIZE", "50000")),
+            ttl=None
+        )
+        # Recently relayed messages, keyed by "channel_id:message_id" of the source and of every mirror
+        self.mirror_cache = TTLCache(
+            max_size=int(os.getenv("MIRROR_CACHE_SIZE", "20000")),
+            ttl=float(os.getenv("MIRROR_CACHE_TTL", "86400"))
+        )
+        self.partition_span = float(os.getenv("HISTORY_PARTITION_DAYS", "7")) * 86400
+        self.partitions_ahead_days = float(os.getenv("HISTORY_PARTITIONS_AHEAD_DAYS", "14"))
+        self.webhooks: Dict[str, tuple] = {}
+        # Updated in place only: DiscordBot.webhooks is this same set
+        self.webhook_ids: Set[int] = set()
+        self.banned_users: Set[str] = set()
+        self.banned_servers: Set[int] = set()
+        self.bans_loaded = False
+        # Set by DiscordBot to fan cache invalidations out to other replicas over Redis
+        self.invalidation_publisher: Optional[Callable[[str], Awaitable[None]]] = None
 
     async def initialize(self):
         self.pool = await asyncpg.create_pool(self.db_url)
 
+    async def warm_caches(self):
+        await self.routing.load(self.pool)
+        await self.load_role_colors()
+        await self.load_bans()
+        await self.load_webhooks()
+
+    def get_cache_stats(self) -> Dict[str, Dict]:
+        return {
+            "users": self.user_cache.stats(),
+            "mirrors": self.mirror_cache.stats()
+        }
+
+    async def publish_invalidation(self, scope: str) -> None:
+        if self.invalidation_publisher:
+            await self.invalidation_publisher(scope)
+
+    async def handle_invalidation(self, scope: str) -> None:
+        if scope in ("routing", "all"):
+            await self.routing.load(self.pool)
+        if scope in ("bans", "all"):
+            await self.load_bans()
+        if scope in ("webhooks", "all"):
+            await self.load_webhooks()
+        if scope == "all":
+            await self.load_role_colors()
+            self.user_cache.clear()
+        if scope.startswith("user:"):
+            self.user_cache.pop(scope[len("user:"):])
+
     # User Management
     # ---------------
 
     async def get_user(self, user_id: str) -> Dict:
+        cached = self.user_cache.get(user_id)
+        if cached:
+            return dict(cached)
+
         async with self.pool.acquire() as conn:
             user = await conn.fetchrow(
                 """
@@ -64,7 +197,14 @@ class WormholeConfig:
                     """,
                     user_id, user_hash
                 )
-            return dict(user)
+        return await self._cache_user(user)
+
+    async def _cache_user(self, user) -> Dict:
+        # Cached rows carry the role colour so get_user_color never needs a Roles lookup
+        user = dict(user)
+        user['role_color'] = await self.get_role_color(user['role'])
+        self.user_cache.set(user['user_id'], user)
+        return dict(user)
 
     async def get_user_usernames(self, user_id: str) -> List[str]:
         async with self.pool.acquire() as conn:
@@ -78,7 +218,7 @@ class WormholeConfig:
 
     async def update_user_config(self, user_id: str, **kwargs):
         async with self.pool.acquire() as conn:
-            await conn.execute(
+            user = await conn.fetchrow(
                 """
                 UPDATE Users SET 
                     role = COALESCE($1, role),
@@ -87,6 +227,7 @@ class WormholeConfig:
                     difficulty_penalty = COALESCE($4, difficulty_penalty),
                     can_send_message = COALESCE($5, can_send_message)
                 WHERE user_id = $6
+                RETURNING *
                 """,
                 kwargs.get('role'),
                 kwargs.get('profile_picture'),
@@ -95,36 +236,63 @@ class WormholeConfig:
                 kwargs.get('can_send_message'),
                 user_id
             )
+        if user:
+            await self._cache_user(user)
+            await self.publish_invalidation(f"user:{user['user_id']}")
+
+    async def resolve_user(self, user_id_or_hash: str) -> Optional[Dict]:
+        if not isinstance(user_id_or_hash, str) or not user_id_or_hash:
+            return None
+
+        if classify_user_id(user_id_or_hash) == "Digit":
+            cached = self.user_cache.get(user_id_or_hash)
+            if cached:
+                return dict(cached)
+            async with self.pool.acquire() as conn:
+                user = await conn.fetchrow(
+                    """
+                    SELECT * FROM Users WHERE user_id = $1
+                    """,
+                    user_id_or_hash
+                )
+            if user:
+                return await self._cache_user(user)
+            # Short all-digit strings are just as likely to be a displayed hash prefix
 
-    async def get_user_by_hash(self, user_hash: str) -> Dict:
+        prefix = user_id_or_hash.lower()
+        if not HEX_PATTERN.match(prefix):
+            return None
+
+        # Byte-wise range scan so users_hash_prefix_idx (text_pattern_ops) can serve it
         async with self.pool.acquire() as conn:
-            if classify_user_id(user_hash) == "Digit":
-                user_hash = hashlib.sha256(f"{self.global_salt}{user_hash}".encode()).hexdigest()
-            user = await conn.fetchrow(
+            users = await conn.fetch(
                 """
-                SELECT * FROM Users 
-                WHERE hash LIKE $1 || '%'
-                ORDER BY LENGTH(hash)
-                LIMIT 1
+                SELECT * FROM Users
+                WHERE hash ~>=~ $1 AND hash ~<~ $2
+                ORDER BY hash
+                LIMIT 2
                 """,
-                user_hash
+                prefix, prefix + "~"
             )
-            return dict(user) if user else {}
+        if not users:
+            return None
+        if len(users) > 1 and users[0]['hash'] != prefix:
+            raise AmbiguousHashError(user_id_or_hash)
+        return await self._cache_user(users[0])
+
+    async def get_user_by_hash(self, user_hash: str) -> Dict:
+        user = await self.resolve_user(user_hash)
+        return user or {}
 
     async def get_user_id_by_hash(self, user_hash: str) -> Optional[str]:
-        async with self.pool.acquire() as conn:
-            user_id = await conn.fetchval(
-                """
-                SELECT user_id FROM Users 
-                WHERE hash LIKE $1 || '%'
-                ORDER BY LENGTH(hash)
-                LIMIT 1
-                """,
-                user_hash
-            )
-            return user_id
+        user = await self.resolve_user(user_hash)
+        return user['user_id'] if user else None
     
     async def get_user_hash_by_id(self, user_id: str) -> Optional[str]:
+        cached = self.user_cache.get(user_id)
+        if cached:
+            return cached['hash']
+
         async with self.pool.acquire() as conn:
             user_hash = await conn.fetchval(
                 """
@@ -139,53 +307,57 @@ class WormholeConfig:
         return user['hash']
 
     async def change_user_role(self, user_hash: str, role: str) -> None:
-        async with self.pool.acquire() as conn:
-            if classify_user_id(user_hash) == "Digit":
-                user_hash = hashlib.sha256(f"{self.global_salt}{user_hash}".encode()).hexdigest()
+        user_id = await self.get_user_id_by_hash(user_hash)
+        if not user_id:
+            return
 
-            await conn.execute(
+        async with self.pool.acquire() as conn:
+            user = await conn.fetchrow(
                 """
-                UPDATE Users SET role = $1 WHERE user_id = (
-                    SELECT user_id FROM Users 
-                    WHERE hash LIKE $2 || '%'
-                    ORDER BY LENGTH(hash)
-                    LIMIT 1
-                )
+                UPDATE Users SET role = $1 WHERE user_id = $2
+                RETURNING *
                 """,
-                role, user_hash
+                role, user_id
             )
+        if user:
+            await self._cache_user(user)
+            await self.publish_invalidation(f"user:{user['user_id']}")
 
     async def add_username(self, user_id: str, name: str) -> None:
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                INSERT INTO Usernames (user_id, name) VALUES ($1, $2)
-                ON CONFLICT (user_id, name) DO NOTHING
-                """,
-                user_id, name
-            )
+        # Buffered, written by flush_profile_updates
+        key = (user_id, name)
+        if key not in self.known_usernames:
+            self.pending_usernames.add(key)
 
     async def is_user_banned(self, user_id: str) -> bool:
-        async with self.pool.acquire() as conn:
-            is_banned = await conn.fetchval(
-                """
-                SELECT EXISTS(SELECT 1 FROM BannedUsers WHERE user_id = $1)
-                """,
-                user_id
-            )
-            
-            is_banned_2 = False
-            if not is_banned:
-                user_id = await self.get_user_id_by_hash(user_id)
-                is_banned_2 = await conn.fetchval(
-                    """
-                    SELECT EXISTS(SELECT 1 FROM BannedUsers WHERE user_id = $1)
-                    """,
-                    user_id
-                )
-            return is_banned or is_banned_2
+        if not self.bans_loaded:
+            await self.load_bans()
+
+        if user_id in self.banned_users:
+            return True
+        if classify_user_id(user_id) == "Digit" and await self.compute_user_hash(user_id) in self.banned_users:
+            return True
+        # Falls back to a hash prefix when no Users.user_id matches, short all-digit prefixes included
+        user = await self.resolve_user(user_id)
+        if not user:
+            return False
+        return user['user_id'] in self.banned_users or user['hash'] in self.banned_users
+
+    async def _ban_keys(self, user_id: str) -> Set[str]:
+        keys = {user_id}
+        user = await self.resolve_user(user_id)
+        if user:
+            keys |= {user['user_id'], user['hash']}
+        elif classify_user_id(user_id) == "Digit":
+            # A Discord id that has not talked through the bot yet
+            keys.add(await self.compute_user_hash(user_id))
+        return keys
 
     async def ban_user(self, user_id: str) -> None:
+        # Store the real user id when the argument is a hash prefix, so the ban survives reloads
+        user = await self.resolve_user(user_id)
+        if user:
+            user_id = user['user_id']
         async with self.pool.acquire() as conn:
             await conn.execute(
                 """
@@ -194,46 +366,155 @@ class WormholeConfig:
                 """,
                 user_id
             )
+        self.banned_users |= await self._ban_keys(user_id)
+        await self.publish_invalidation("bans")
 
     async def unban_user(self, user_id: str) -> None:
         async with self.pool.acquire() as conn:
             await conn.execute(
                 """
-                DELETE FROM BannedUsers WHERE user_id = $1
+                DELETE FROM BannedUsers WHERE user_id = ANY($1::varchar[])
                 """,
-                user_id
+                list(await self._ban_keys(user_id))
             )
-    
-    async def update_user_avatar(self, user_id: str, avatar: str) -> None:
+        await self.load_bans()
+        await self.publish_invalidation("bans")
+
+    async def load_bans(self) -> None:
         async with self.pool.acquire() as conn:
-            await conn.execute(
+            banned_users = await conn.fetch(
+                """
+                SELECT b.user_id AS banned_id, u.user_id, u.hash
+                FROM BannedUsers b
+                LEFT JOIN Users u ON u.user_id = b.user_id OR u.hash = b.user_id
+                """
+            )
+            banned_servers = await conn.fetch(
+                """
+                SELECT server_id FROM BannedServers
                 """
-                UPDATE Users SET profile_picture = $1 WHERE user_id = $2
-                """,
-                avatar, user_id
             )
 
+        banned = set()
+        unresolved = []
+        for row in banned_users:
+            banned.add(row['banned_id'])
+            if row['user_id']:
+                banned.add(row['user_id'])
+                banned.add(row['hash'])
+            else:
+                unresolved.append(row['banned_id'])
+        for key in unresolved:
+            try:
+                banned |= await self._ban_keys(key)
+            except AmbiguousHashError as e:
+                # A legacy short-prefix ban that now matches several users; the raw key above still applies
+                self.logger.warning(f"Could not resolve ban {key}: {str(e)}")
+
+        self.banned_users = banned
+        self.banned_servers = {int(server['server_id']) for server in banned_servers}
+        self.bans_loaded = True
+    
+    async def update_user_avatar(self, user_id: str, avatar: str) -> None:
+        # Buffered, written by flush_profile_updates
+        cached = self.user_cache.peek(user_id)
+        if user_id not in self.pending_avatars and cached and cached['profile_picture'] == avatar:
+            return
+        self.pending_avatars[user_id] = avatar
+        if cached:
+            cached['profile_picture'] = avatar
+
+    async def flush_profile_updates(self) -> None:
+        avatars, self.pending_avatars = self.pending_avatars, {}
+        usernames, self.pending_usernames = self.pending_usernames, set()
+        if not avatars and not usernames:
+            return
+
+        try:
+            async with self.pool.acquire() as conn:
+                if avatars:
+                    await conn.executemany(
+                        """
+                        UPDATE Users SET profile_picture = $2
+                        WHERE user_id = $1 AND profile_picture IS DISTINCT FROM $2
+                        """,
+                        list(avatars.items())
+                    )
+                if usernames:
+                    await conn.executemany(
+                        """
+                        INSERT INTO Usernames (user_id, name) VALUES ($1, $2)
+                        ON CONFLICT (user_id, name) DO NOTHING
+                        """,
+                        list(usernames)
+                    )
+        except Exception:
+            # Put the batch back without clobbering anything queued since
+            self.pending_avatars = {**avatars, **self.pending_avatars}
+            self.pending_usernames |= usernames
+            raise
+
+        for key in usernames:
+            self.known_usernames.set(key, True)
+
     async def user_exists(self, user_id: str) -> bool:
+        return await self.resolve_user(user_id) is not None
+
+    async def get_relay_context(self, user_id: str, channel_id: str) -> Dict:
+        if self.routing.loaded and self.bans_loaded:
+            cached = self.user_cache.get(user_id)
+            if cached:
+                return {
+                    "user": dict(cached),
+                    "banned": await self.is_user_banned(user_id),
+                    "channel": self.routing.get_channel(channel_id),
+                    "peers": self.routing.get_peers(channel_id)
+                }
+
+        # Cold path: user row (created if missing), role colour, ban flag, channel and peers in one round-trip
+        user_hash = await self.compute_user_hash(user_id)
         async with self.pool.acquire() as conn:
-            user = await conn.fetchval(
+            context = await conn.fetchrow(
                 """
-                SELECT EXISTS(SELECT 1 FROM Users WHERE hash LIKE $1 || '%')
-                ORDER BY LENGTH(hash)
-                LIMIT 1
+                WITH existing AS (
+                    SELECT * FROM Users WHERE user_id = $1
+                ),
+                inserted AS (
+                    INSERT INTO Users (user_id, hash)
+                    SELECT $1, $3 WHERE NOT EXISTS (SELECT 1 FROM existing)
+                    ON CONFLICT (user_id) DO UPDATE SET hash = EXCLUDED.hash
+                    RETURNING *
+                ),
+                u AS (
+                    SELECT * FROM existing UNION ALL SELECT * FROM inserted
+                ),
+                c AS (
+                    SELECT * FROM Channels WHERE channel_id = $2
+                )
+                SELECT
+                    (SELECT row_to_json(u) FROM u) AS user_row,
+                    (SELECT r.color FROM Roles r JOIN u ON r.name = u.role) AS role_color,
+                    EXISTS(SELECT 1 FROM BannedUsers WHERE user_id IN ($1, $3)) AS banned,
+                    (SELECT row_to_json(c) FROM c) AS channel_row,
+                    ARRAY(
+                        SELECT p.channel_id FROM Channels p JOIN c ON p.channel_category = c.channel_category
+                    ) AS peers
                 """,
-                user_id
+                user_id, channel_id, user_hash
             )
-            
-            user2 = False
-            if classify_user_id(user_id) == "Digit":
-                user_hash = hashlib.sha256(f"{self.global_salt}{user_id}".encode()).hexdigest()
-                user2 = await conn.fetchval(
-                    """
-                    SELECT EXISTS(SELECT 1 FROM Users WHERE hash = $1)
-                    """,
-                    user_hash
-                )
-            return user or user2
+
+        user = json.loads(context['user_row'])
+        if context['role_color']:
+            self.role_colors[user['role']] = int(context['role_color'][1:], 16)
+        channel = json.loads(context['channel_row']) if context['channel_row'] else None
+        if channel and self.routing.loaded:
+            self.routing.set_channel(channel)
+        return {
+            "user": await self._cache_user(user),
+            "banned": await self.is_user_banned(user_id) if self.bans_loaded else context['banned'],
+            "channel": channel,
+            "peers": list(context['peers'])
+        }
 
     # Message and Attachment History
     # ------------------------------
@@ -243,25 +524,34 @@ class WormholeConfig:
 
     @auto_configure_user
     async def update_user_message_history(self, user_id: str, message_link: str, message_hash: str):
+        await self.add_message_history(user_id, message_hash)
+        await self.append_link(message_hash, [message_link])
+
+    async def add_message_history(self, user_id: str, message_hash: str):
         async with self.pool.acquire() as conn:
             await conn.execute(
                 """
-                INSERT INTO MessageHistory (hash, message_link, user_id, timestamp)
-                VALUES ($1, ARRAY[$2], $3, $4)
-                ON CONFLICT (hash) DO NOTHING
+                INSERT INTO MessageHistory (hash, user_id, timestamp)
+                VALUES ($1, $2, $3)
+                ON CONFLICT DO NOTHING
                 """,
-                message_hash, message_link, user_id, time.time()
+                message_hash, user_id, time.time()
             )
 
     async def append_link(self, message_hash: str, message_links: list):
+        if not message_links:
+            return
+
+        server_ids, channel_ids, message_ids = zip(*map(self.split_message_link, message_links))
         async with self.pool.acquire() as conn:
             await conn.execute(
                 """
-                UPDATE MessageHistory 
-                SET message_link = array_cat(message_link, $1::varchar[])
-                WHERE hash = $2
+                INSERT INTO MessageLinks (hash, server_id, channel_id, message_id, timestamp)
+                SELECT $1, link.server_id, link.channel_id, link.message_id, $5
+                FROM unnest($2::varchar[], $3::varchar[], $4::varchar[]) AS link(server_id, channel_id, message_id)
+                ON CONFLICT DO NOTHING
                 """,
-                message_links, message_hash
+                message_hash, list(server_ids), list(channel_ids), list(message_ids), time.time()
             )
 
     async def add_attachment_history(self, user_id: str, attachment_link: str):
@@ -271,7 +561,7 @@ class WormholeConfig:
                 """
                 INSERT INTO AttachmentHistory (hash, attachment_link, user_id, timestamp)
                 VALUES ($1, $2, $3, $4)
-                ON CONFLICT (hash) DO NOTHING
+                ON CONFLICT DO NOTHING
                 """,
                 hashed_content, attachment_link, user_id, time.time()
             )
@@ -290,45 +580,139 @@ class WormholeConfig:
             )
 
     async def get_message_hash_by_link(self, message_link):
+        channel_id, message_id = self.parse_message_link(message_link)
         async with self.pool.acquire() as conn:
             return await conn.fetchval(
                 """
-                SELECT hash FROM MessageHistory
-                WHERE $1 = ANY(message_link)
+                SELECT hash FROM MessageLinks
+                WHERE channel_id = $1 AND message_id = $2
                 """,
-                message_link
+                channel_id, message_id
             )
 
     async def get_message_links(self, message_hash):
         async with self.pool.acquire() as conn:
-            return await conn.fetchval(
+            links = await conn.fetch(
                 """
-                SELECT message_link FROM MessageHistory
+                SELECT server_id, channel_id, message_id FROM MessageLinks
                 WHERE hash = $1
                 """,
                 message_hash
             )
+            return [
+                f"https://discord.com/channels/{link['server_id']}/{link['channel_id']}/{link['message_id']}"
+                for link in links
+            ]
 
     @staticmethod
     def parse_message_link(link):
         parts = link.split('/')
         return parts[-2], parts[-1]
 
+    @staticmethod
+    def split_message_link(link):
+        parts = link.split('/')
+        return parts[-3], parts[-2], parts[-1]
+
+    # Mirror Index
+    # ------------
+
+    async def record_mirrors(self, message_hash: str, source_link: str, mirror_links: list,
+                             author: str = None, content: str = None, shared: bool = False) -> None:
+        links = [source_link] + mirror_links
+        server_ids, channel_ids, message_ids = zip(*map(self.split_message_link, links))
+        sources = [True] + [False] * len(mirror_links)
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO MessageLinks (hash, server_id, channel_id, message_id, source, timestamp)
+                SELECT $1, link.server_id, link.channel_id, link.message_id, link.source, $6
+                FROM unnest($2::varchar[], $3::varchar[], $4::varchar[], $5::boolean[])
+                    AS link(server_id, channel_id, message_id, source)
+                ON CONFLICT DO NOTHING
+                """,
+                message_hash, list(server_ids), list(channel_ids), list(message_ids), sources, time.time()
+            )
+
+        entry = {
+            "hash": message_hash,
+            "author": author,
+            "content": content,
+            "shared": shared,
+            "links": {
+                channel_id: (server_id, message_id, source)
+                for server_id, channel_id, message_id, source in zip(server_ids, channel_ids, message_ids, sources)
+            }
+        }
+        self._cache_mirror_entry(entry)
+
+    def _cache_mirror_entry(self, entry: Dict) -> None:
+        for channel_id, (_, message_id, source) in entry["links"].items():
+            # A merged mirror belongs to several sources; keep the first so lookups stay stable
+            if source or not self.mirror_cache.peek(f"{channel_id}:{message_id}"):
+                self.mirror_cache.set(f"{channel_id}:{message_id}", entry)
+
+    def get_cached_mirror_entry(self, channel_id: str, message_id: str) -> Optional[Dict]:
+        return self.mirror_cache.get(f"{channel_id}:{message_id}")
+
+    async def get_mirror_entry(self, channel_id: str, message_id: str) -> Optional[Dict]:
+        # Finds a relayed message (by its source or any mirror) and every copy of it
+        entry = self.get_cached_mirror_entry(channel_id, message_id)
+        if entry:
+            return entry
+
+        async with self.pool.acquire() as conn:
+            links = await conn.fetch(
+                """
+                SELECT l.hash, l.server_id, l.channel_id, l.message_id, l.source,
+                    EXISTS(
+                        SELECT 1 FROM MessageLinks o
+                        WHERE o.channel_id = l.channel_id AND o.message_id = l.message_id AND o.hash <> l.hash
+                    ) AS shared
+                FROM MessageLinks l
+                WHERE l.hash = (
+                    SELECT hash FROM MessageLinks WHERE channel_id = $1 AND message_id = $2 LIMIT 1
+                )
+                """,
+                channel_id, message_id
+            )
+        if not links:
+            return None
+
+        entry = {
+            "hash": links[0]['hash'],
+            "author": None,
+            "content": None,
+            "shared": any(link['shared'] for link in links),
+            "links": {
+                link['channel_id']: (link['server_id'], link['message_id'], link['source']) for link in links
+            }
+        }
+        self._cache_mirror_entry(entry)
+        return entry
+
+    def forget_mirror_entry(self, entry: Dict) -> None:
+        for channel_id, (_, message_id, _) in entry["links"].items():
+            self.mirror_cache.pop(f"{channel_id}:{message_id}")
+
     # Channel Management
     # ------------------
 
     async def add_channel(self, channel_name: str, channel_id: str, server_id: int):
         async with self.pool.acquire() as conn:
-            await conn.execute(
+            channel = await conn.fetchrow(
                 """
                 INSERT INTO Channels (channel_id, server_id, channel_category)
                 VALUES ($1, $2, $3)
                 ON CONFLICT (channel_id) DO UPDATE SET
                     server_id = $2,
                     channel_category = $3
+                RETURNING *
                 """,
                 channel_id, server_id, channel_name
             )
+        self.routing.set_channel(dict(channel))
+        await self.publish_invalidation("routing")
             
     async def remove_channel(self, channel_id: str) -> None:
         async with self.pool.acquire() as conn:
@@ -338,40 +722,39 @@ class WormholeConfig:
                 """,
                 channel_id
             )
+        self.routing.drop_channel(channel_id)
+        await self.publish_invalidation("routing")
     
     async def join_channel(self, channel_name: str, channel_id: str, server_id: str) -> bool:
         async with self.pool.acquire() as conn:
-            await conn.execute(
+            channel = await conn.fetchrow(
                 """
-                INSERT INTO Channels (channel_id, channel_category, server_id)
-                VALUES ($1, $2, $3)
+                INSERT INTO Channels (channel_id, channel_category, server_id, coalesce_ms)
+                VALUES ($1, $2, $3, (
+                    SELECT COALESCE(MAX(coalesce_ms), 0) FROM Channels WHERE channel_category = $2
+                ))
                 ON CONFLICT (channel_id) DO NOTHING
+                RETURNING *
                 """,
                 channel_id, channel_name, server_id
             )
-            return True
+        if channel:
+            self.routing.set_channel(dict(channel))
+            await self.publish_invalidation("routing")
+        return True
     
     async def leave_channel(self, channel_id: str) -> bool:
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                DELETE FROM Channels WHERE channel_id = $1
-                """,
-                channel_id
-            )
-            return True
+        await self.remove_channel(channel_id)
+        return True
     
     async def get_channel_category_by_id(self, channel_id: str) -> Optional[str]:
-        async with self.pool.acquire() as conn:
-            channel = await conn.fetchval(
-                """
-                SELECT channel_category FROM Channels WHERE channel_id = $1
-                """,
-                channel_id
-            )
-            return channel
+        channel = await self.get_channel_by_id(channel_id)
+        return channel['channel_category'] if channel else None
 
     async def get_channel_by_id(self, channel_id: str) -> Dict:
+        if self.routing.loaded:
+            return self.routing.get_channel(channel_id)
+
         async with self.pool.acquire() as conn:
             channel = await conn.fetchrow(
                 """
@@ -382,16 +765,12 @@ class WormholeConfig:
             return dict(channel) if channel else None
 
     async def get_channel_name_by_id(self, channel_id: str) -> Optional[str]:
-        async with self.pool.acquire() as conn:
-            channel = await conn.fetchval(
-                """
-                SELECT channel_category FROM Channels WHERE channel_id = $1
-                """,
-                channel_id
-            )
-            return channel
+        return await self.get_channel_category_by_id(channel_id)
 
     async def get_all_channels(self) -> List[Dict]:
+        if self.routing.loaded:
+            return [{'channel_name': name} for name in self.routing.channel_list]
+
         async with self.pool.acquire() as conn:
             channels = await conn.fetch(
                 """
@@ -401,16 +780,22 @@ class WormholeConfig:
             return [dict(channel) for channel in channels]
 
     async def channel_exists(self, channel_id: str) -> bool:
+        if self.routing.loaded:
+            return channel_id in self.routing.channels
+
         async with self.pool.acquire() as conn:
             channel = await conn.fetchval(
                 """
-                SELECT EXISTS(SELECT 1 FROM Channel WHERE channel_id = $1)
+                SELECT EXISTS(SELECT 1 FROM Channels WHERE channel_id = $1)
                 """,
                 channel_id
             )
             return channel
 
     async def category_exists(self, category: str) -> bool:
+        if self.routing.loaded:
+            return category in self.routing.channel_list
+
         async with self.pool.acquire() as conn:
             result = await conn.fetchval(
                 """
@@ -421,6 +806,9 @@ class WormholeConfig:
             return result
 
     async def get_channels_by_category(self, category: str) -> List[Dict]:
+        if self.routing.loaded:
+            return self.routing.get_category(category)
+
         async with self.pool.acquire() as conn:
             channels = await conn.fetch(
                 """
@@ -430,7 +818,23 @@ class WormholeConfig:
             )
             return [dict(channel) for channel in channels]
     
+    async def get_category_channel_ids(self, category: str) -> List[str]:
+        if self.routing.loaded:
+            return self.routing.get_category_ids(category)
+
+        async with self.pool.acquire() as conn:
+            channels = await conn.fetch(
+                """
+                SELECT channel_id FROM Channels WHERE channel_category = $1
+                """,
+                category
+            )
+            return [channel['channel_id'] for channel in channels]
+
     async def get_all_channels_in_category_by_id(self, channel_id: str) -> List[str]:
+        if self.routing.loaded:
+            return self.routing.get_peers(channel_id)
+
         async with self.pool.acquire() as conn:
             channels = await conn.fetch(
                 """
@@ -467,14 +871,9 @@ class WormholeConfig:
             return dict(server) if server else None
 
     async def is_server_banned(self, server_id: int) -> bool:
-        async with self.pool.acquire() as conn:
-            is_banned = await conn.fetchval(
-                """
-                SELECT COUNT(*) FROM BannedServers WHERE server_id = $1
-                """,
-                server_id
-            )
-            return is_banned > 0
+        if not self.bans_loaded:
+            await self.load_bans()
+        return int(server_id) in self.banned_servers
 
     async def ban_server(self, server_id: int) -> None:
         async with self.pool.acquire() as conn:
@@ -485,6 +884,8 @@ class WormholeConfig:
                 """,
                 server_id
             )
+        self.banned_servers.add(int(server_id))
+        await self.publish_invalidation("bans")
 
     async def unban_server(self, server_id: int) -> None:
         async with self.pool.acquire() as conn:
@@ -494,22 +895,20 @@ class WormholeConfig:
                 """,
                 server_id
             )
+        self.banned_servers.discard(int(server_id))
+        await self.publish_invalidation("bans")
 
     # Role Management
     # ---------------
 
     async def get_user_color(self, user_id: str) -> int:
-        async with self.pool.acquire() as conn:
-            user = await self.get_user(user_id)
-            role = await conn.fetchrow(
-                """
-                SELECT color FROM Roles WHERE name = $1
-                """,
-                user['role']
-            )
-            return int(role['color'][1:], 16) if role else 0
+        user = await self.get_user(user_id)
+        return user['role_color']
 
     async def get_role_color(self, role: str) -> int:
+        if role in self.role_colors:
+            return self.role_colors[role]
+
         async with self.pool.acquire() as conn:
             role_data = await conn.fetchrow(
                 """
@@ -517,19 +916,23 @@ class WormholeConfig:
                 """,
                 role
             )
-            return int(role_data['color'][1:], 16) if role_data else 0
+        color = int(role_data['color'][1:], 16) if role_data else 0
+        if role_data:
+            self.role_colors[role] = color
+        return color
 
-    async def get_user_role(self, user_id: str) -> str:
+    async def load_role_colors(self) -> None:
         async with self.pool.acquire() as conn:
-            if classify_user_id(user_id) != "Digit":
-                user_id = await self.get_user_id_by_hash(user_id)
-            role = await conn.fetchval(
+            roles = await conn.fetch(
+                """
+                SELECT name, color FROM Roles
                 """
-                SELECT role FROM Users WHERE user_id = $1
-                """,
-                user_id
             )
-            return role
+        self.role_colors = {role['name']: int(role['color'][1:], 16) for role in roles}
+
+    async def get_user_role(self, user_id: str) -> str:
+        user = await self.resolve_user(user_id)
+        return user['role'] if user else None
 
     # Utility Functions
     # -----------------
@@ -545,6 +948,9 @@ class WormholeConfig:
                     """,
                     nonce, user_id
             )
+            cached = self.user_cache.peek(user_id)
+            if cached:
+                cached['nonce'] = nonce
 
     # Admin Management
     # ----------------
@@ -590,6 +996,8 @@ class WormholeConfig:
                 """,
                 channel_name
             )
+        self.routing.channel_list.add(channel_name)
+        await self.publish_invalidation("routing")
 
     async def remove_channel_from_list(self, channel_name: str) -> None:
         async with self.pool.acquire() as conn:
@@ -599,8 +1007,13 @@ class WormholeConfig:
                 """,
                 channel_name
             )
+        self.routing.channel_list.discard(channel_name)
+        await self.publish_invalidation("routing")
 
     async def get_channel_list(self) -> List[str]:
+        if self.routing.loaded:
+            return list(self.routing.channel_list)
+
         async with self.pool.acquire() as conn:
             channels = await conn.fetch(
                 """
@@ -609,27 +1022,90 @@ class WormholeConfig:
             )
             return [channel['channel_name'] for channel in channels]
 
+    # Webhook Management
+    # ------------------
+
+    async def load_webhooks(self) -> None:
+        async with self.pool.acquire() as conn:
+            webhooks = await conn.fetch(
+                """
+                SELECT channel_id, webhook_id, webhook_token FROM Webhooks
+                """
+            )
+        self.webhooks = {
+            webhook['channel_id']: (int(webhook['webhook_id']), webhook['webhook_token'])
+            for webhook in webhooks
+        }
+        self.webhook_ids.update(webhook_id for webhook_id, _ in self.webhooks.values())
+
+    def get_webhook(self, channel_id: str) -> Optional[tuple]:
+        return self.webhooks.get(channel_id)
+
+    async def set_webhook(self, channel_id: str, webhook_id: int, webhook_token: str) -> None:
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO Webhooks (channel_id, webhook_id, webhook_token)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (channel_id) DO UPDATE SET
+                    webhook_id = $2,
+                    webhook_token = $3
+                """,
+                channel_id, str(webhook_id), webhook_token
+            )
+        self.webhooks[channel_id] = (webhook_id, webhook_token)
+        self.webhook_ids.add(webhook_id)
+        await self.publish_invalidation("webhooks")
+
+    async def remove_webhook(self, channel_id: str) -> None:
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                DELETE FROM Webhooks WHERE channel_id = $1
+                """,
+                channel_id
+            )
+        self.webhooks.pop(channel_id, None)
+        await self.publish_invalidation("webhooks")
+
     # React Feature Management
     # ------------------------
 
     async def set_channel_react(self, channel_id: str, react: bool) -> None:
         async with self.pool.acquire() as conn:
-            await conn.execute(
+            channel = await conn.fetchrow(
                 """
                 UPDATE Channels SET react = $1 WHERE channel_id = $2
+                RETURNING *
                 """,
                 react, channel_id
             )
+        if channel:
+            self.routing.set_channel(dict(channel))
+            await self.publish_invalidation("routing")
 
     async def get_channel_react(self, channel_id: str) -> bool:
+        channel = await self.get_channel_by_id(channel_id)
+        react = channel['react'] if channel else None
+        return react if react is not None else False
+
+    # Coalescing Management
+    # ---------------------
+
+    async def set_category_coalesce(self, category: str, coalesce_ms: int) -> int:
         async with self.pool.acquire() as conn:
-            react = await conn.fetchval(
+            channels = await conn.fetch(
                 """
-                SELECT react FROM Channels WHERE channel_id = $1
+                UPDATE Channels SET coalesce_ms = $1 WHERE channel_category = $2
+                RETURNING *
                 """,
-                channel_id
+                coalesce_ms, category
             )
-            return react if react is not None else False
+        for channel in channels:
+            self.routing.set_channel(dict(channel))
+        if channels:
+            await self.publish_invalidation("routing")
+        return len(channels)
 
     # Batch Operations
     # ----------------
@@ -704,39 +1180,59 @@ class WormholeConfig:
             if time_range:
                 count = await conn.fetchval(
                     """
-                    SELECT COUNT(*) FROM MessageHistory
-                    WHERE message_link LIKE $1 AND timestamp > $2
+                    SELECT COUNT(DISTINCT hash) FROM MessageLinks
+                    WHERE channel_id = $1 AND timestamp > $2
                     """,
-                    f"%{channel_id}%", time.time() - time_range
+                    channel_id, time.time() - time_range
                 )
             else:
                 count = await conn.fetchval(
                     """
-                    SELECT COUNT(*) FROM MessageHistory
-                    WHERE message_link LIKE $1
+                    SELECT COUNT(DISTINCT hash) FROM MessageLinks
+                    WHERE channel_id = $1
                     """,
-                    f"%{channel_id}%"
+                    channel_id
                 )
             return count
 
     # Cleanup and Maintenance
     # -----------------------
 
+    async def ensure_history_partitions(self, days_ahead: Optional[float] = None) -> None:
+        days_ahead = days_ahead if days_ahead is not None else self.partitions_ahead_days
+        now = time.time()
+        async with self.pool.acquire() as conn:
+            for table in PARTITIONED_TABLES:
+                await ensure_partitions(conn, table, now - self.partition_span, now + days_ahead * 86400, self.partition_span)
+
     async def clear_old_messages(self, days: int) -> int:
+        # Drops whole partitions that ended before the cutoff and, as the DELETE it replaced did, returns
+        # how many MessageHistory rows were removed. Tables that have not been converted by the migration
+        # still fall back to a DELETE.
+        cutoff = time.time() - (days * 24 * 60 * 60)
+        deleted = 0
         async with self.pool.acquire() as conn:
-            deleted = await conn.fetchval(
-                """
-                DELETE FROM MessageHistory
-                WHERE timestamp < $1
-                RETURNING COUNT(*)
-                """,
-                time.time() - (days * 24 * 60 * 60)
-            )
-            return deleted
+            for table in PARTITIONED_TABLES:
+                partitions = await get_partitions(conn, table)
+                if partitions is None:
+                    status = await conn.execute(f"DELETE FROM {table} WHERE timestamp < $1", cutoff)
+                    removed = int(status.split()[-1])
+                else:
+                    removed = 0
+                    for name, _, upper in partitions:
+                        if upper <= cutoff:
+                            removed += await conn.fetchval(f"SELECT count(*) FROM {name}")
+                            await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {name} CONCURRENTLY")
+                            await conn.execute(f"DROP TABLE {name}")
+                            self.logger.info(f"Dropped history partition {name}")
+                if table == "MessageHistory":
+                    deleted = removed
+        return deleted
 
     async def optimize_database(self):
+        # Retention drops partitions instead of deleting rows, so there is no bloat to VACUUM away
         async with self.pool.acquire() as conn:
-            await conn.execute("VACUUM ANALYZE")
+            await conn.execute(f"ANALYZE {', '.join(PARTITIONED_TABLES)}")
 
     # Configuration Management
     # ------------------------
@@ -752,6 +1248,79 @@ class WormholeConfig:
 
 # Additional utility functions outside the class
 
+PARTITIONED_TABLES = ("MessageHistory", "AttachmentHistory", "MessageLinks")
+PARTITION_BOUND_PATTERN = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+def _parse_partition_bound(bound: str) -> float:
+    bound = bound.strip("'")
+    if bound == "MINVALUE":
+        return -math.inf
+    if bound == "MAXVALUE":
+        return math.inf
+    return float(bound)
+
+async def get_partitions(conn, table: str) -> Optional[List[tuple]]:
+    # (name, lower, upper) for each range partition, or None if the table is not partitioned
+    relkind = await conn.fetchval(
+        """
+        SELECT relkind::text FROM pg_class WHERE oid = to_regclass($1)
+        """,
+        table.lower()
+    )
+    if relkind != 'p':
+        return None
+
+    rows = await conn.fetch(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass($1)
+        """,
+        table.lower()
+    )
+    partitions = []
+    for row in rows:
+        match = PARTITION_BOUND_PATTERN.search(row['bound'])
+        if match:
+            partitions.append((row['relname'], _parse_partition_bound(match.group(1)), _parse_partition_bound(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+async def ensure_partitions(conn, table: str, start: float, end: float, span: float) -> None:
+    partitions = await get_partitions(conn, table)
+    if partitions is None:
+        return
+
+    # Day-aligned spans keep the short date names; shorter spans need the time of day to stay unique
+    name_format = "%Y%m%d" if span % 86400 == 0 else "%Y%m%d_%H%M%S"
+    lower = math.floor(start / span) * span
+    while lower < end:
+        upper = lower + span
+        if not any(p_lower < upper and lower < p_upper for _, p_lower, p_upper in partitions):
+            name = f"{table.lower()}_p{datetime.fromtimestamp(lower, timezone.utc):{name_format}}"
+            await conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table}
+                FOR VALUES FROM ({lower}) TO ({upper})
+                """
+            )
+            partitions.append((name, lower, upper))
+        lower = upper
+
+async def ensure_legacy_partition(conn, table: str, name: str) -> None:
+    # A catch-all partition for rows older than the first regular partition, e.g. backfilled history
+    partitions = await get_partitions(conn, table)
+    if partitions is None or any(lower == -math.inf for _, lower, _ in partitions):
+        return
+
+    upper = partitions[0][1] if partitions else time.time()
+    await conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table}
+        FOR VALUES FROM (MINVALUE) TO ({upper})
+        """
+    )
+
 async def create_tables(pool):
     async with pool.acquire() as conn:
         await conn.execute('''
@@ -768,32 +1337,54 @@ async def create_tables(pool):
 
             CREATE TABLE IF NOT EXISTS Channels (
                 channel_id VARCHAR(255) PRIMARY KEY,
-                server_id INT NOT NULL,
+                server_id VARCHAR(255) NOT NULL,
                 channel_category VARCHAR(255) NOT NULL,
-                react BOOLEAN DEFAULT FALSE
+                react BOOLEAN DEFAULT FALSE,
+                coalesce_ms INT DEFAULT 0
+            );
+
+            CREATE TABLE IF NOT EXISTS Webhooks (
+                channel_id VARCHAR(255) PRIMARY KEY,
+                webhook_id VARCHAR(255) NOT NULL,
+                webhook_token VARCHAR(255) NOT NULL
             );
 
             CREATE TABLE IF NOT EXISTS Usernames (
-                user_id VARCHAR(255) PRIMARY KEY,
+                id SERIAL PRIMARY KEY,
+                user_id VARCHAR(255) NOT NULL,
                 name VARCHAR(255),
+                UNIQUE (user_id, name),
                 FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
             );
 
             CREATE TABLE IF NOT EXISTS MessageHistory (
-                hash VARCHAR(255) NOT NULL PRIMARY KEY,
-                message_link VARCHAR(255),
+                hash VARCHAR(255) NOT NULL,
                 user_id VARCHAR(255),
                 timestamp FLOAT NOT NULL,
+                PRIMARY KEY (hash, timestamp),
                 FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
-            );
+            ) PARTITION BY RANGE (timestamp);
+
+            CREATE TABLE IF NOT EXISTS MessageLinks (
+                hash VARCHAR(255) NOT NULL,
+                server_id VARCHAR(255),
+                channel_id VARCHAR(255) NOT NULL,
+                message_id VARCHAR(255) NOT NULL,
+                source BOOLEAN DEFAULT FALSE,
+                timestamp FLOAT NOT NULL,
+                PRIMARY KEY (channel_id, message_id, timestamp)
+            ) PARTITION BY RANGE (timestamp);
+
+            CREATE INDEX IF NOT EXISTS messagelinks_hash_idx ON MessageLinks (hash);
 
             CREATE TABLE IF NOT EXISTS AttachmentHistory (
-                hash VARCHAR(255) NOT NULL PRIMARY KEY,
+                hash VARCHAR(255) NOT NULL,
                 attachment_link VARCHAR(255),
                 user_id VARCHAR(255),
                 timestamp FLOAT NOT NULL,
+                PRIMARY KEY (hash, timestamp),
                 FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
-            );
+            ) PARTITION BY RANGE (timestamp);
 
             CREATE TABLE IF NOT EXISTS TempCommandMessageHistory (
                 message_id SERIAL PRIMARY KEY,
@@ -829,6 +1420,12 @@ async def create_tables(pool):
                 user_id VARCHAR(255) PRIMARY KEY
             );
 
+            CREATE TABLE IF NOT EXISTS dataset (
+                id VARCHAR(255) PRIMARY KEY,
+                predicted TEXT,
+                actual TEXT
+            );
+
         ''')
 
 async def initialize_database(config: WormholeConfig):
@@ -877,6 +1474,9 @@ async def initialize_database(config: WormholeConfig):
                 ON CONFLICT (channel_name) DO NOTHING
             ''', channel)
 
+    await config.ensure_history_partitions()
+    await config.warm_caches()
+
 if __name__ == "__main__":
     config = WormholeConfig()
     asyncio.run(initialize_database(config))
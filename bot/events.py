@@ -1,15 +1,31 @@
 import asyncio
+import functools
 import hashlib
 import time
 import discord
 import json
 
 from discord.ext import commands
+from bot.features.coalesce import MessageCoalescer
+from bot.features.relay_message import RelayMessage
 from services.discord import DiscordBot
 
 class EventHandlers(commands.Cog):
     def __init__(self, bot):
         self.bot: DiscordBot = bot
+        self.coalescer = MessageCoalescer(self.flush_coalesced)
+        # Tasks waiting on dispatcher futures; kept out of the bookkeeping workers so a rate-limited
+        # destination can't hold them (and the history writes queued behind them) up
+        self.pending_deliveries = set()
+
+    async def cog_unload(self):
+        await self.drain()
+
+    async def drain(self, timeout: float = 5):
+        # Held bursts are relayed first so their deliveries are among those waited on
+        await self.coalescer.flush_all()
+        if self.pending_deliveries:
+            await asyncio.wait(self.pending_deliveries, timeout=timeout)
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -27,114 +43,243 @@ class EventHandlers(commands.Cog):
 
         user_id = str(message.author.id)
         channel_id = str(message.channel.id)
-        message_hash = hashlib.sha256((message.content + user_id + channel_id).encode()).hexdigest()
+        # The message id keeps repeated identical messages from sharing one set of mirror links
+        message_hash = hashlib.sha256((message.content + user_id + channel_id + str(message.id)).encode()).hexdigest()
 
-        if await self.bot.config.is_user_banned(user_id):
+        relay_context = await self.bot.config.get_relay_context(user_id, channel_id)
+        if relay_context["banned"]:
             return
         
-        # TODO Turn this into 2 lines
-        # await self.bot.bot.config.can_send_message(message.author.id)
-        user = await self.bot.config.get_user(user_id)
+        user = relay_context["user"]
         if not user['can_send_message']:
             return
 
-        if await self.bot.config.get_channel_by_id(channel_id):
-            channel_config = await self.bot.config.get_channel_by_id(channel_id)
-            await self.handle_config_pre(channel_config, message)
-
-            tasks = list()
-            reply_messages = []
-            display_name = message.author.display_name
-            avatar = message.author.display_avatar.url
-            content = message.content
-            user_hash = await self.bot.config.get_user_hash(user_id)
-            message_reference = message.reference
+        channel_config = relay_context["channel"]
+        if channel_config:
+            # Fast path: only what is needed to build the relayed message runs before deliveries
+            # are queued. Everything else goes to the bot's background queues.
             channel_category = channel_config["channel_category"]
+            channels = relay_context["peers"]
 
-            embed = await self.bot.pretty_message.to_embed(user_id, display_name, avatar, content)
-            attachments = self.bot.pretty_message.to_attachments_message(message.attachments)
-            embeds = self.bot.pretty_message.embeds_to_links(message.embeds)
-            mentions = self.bot.pretty_message.format_mentions(message.raw_mentions)
-            stickers_to_send, sticker_content = await self.bot.pretty_message.handle_stickers(message)
-
-            self.bot.pretty_message.create_rich_message_box(display_name, content, attachments, user_hash)
-            await self.bot.config.update_user_avatar(user_id, avatar)
-            await self.bot.config.add_username(user_id, display_name)
-            channels = await self.bot.config.get_all_channels_in_category_by_id(channel_id)
-
-            if message_reference:
-                reply_content = message_reference.resolved.content
-                reply_content = reply_content.replace("\n", "\n> ")
-                content = f"> {reply_content}\n{content}"
-            
             # Check if own channel can manage webhooks
-            permissions = message.channel.permissions_for(message.guild.me)
-            if not permissions.manage_webhooks:
-                await message.channel.send(
-                    f":warning: I need the 'Manage Webhooks' permission in this server to send/receive wormhole messages."
-                )
+            if not self.bot.permissions.can_relay(message.channel):
+                if self.bot.permissions.should_warn(message.channel.id):
+                    await message.channel.send(
+                        f":warning: I need the 'Manage Webhooks' permission in this server to send/receive wormhole messages."
+                    )
                 return
 
-            for channel_id in channels:
-                if int(channel_id) == message.channel.id:
-                    continue
-                channel = self.bot.get_channel(int(channel_id))
-                if channel:
-                    permissions = channel.permissions_for(channel.guild.me)
-                    if permissions.manage_webhooks:
-                        webhooks = await channel.webhooks()
-                        webhook = discord.utils.get(webhooks, name="WormholeWebhook")
-                        webhook = webhook or await channel.create_webhook(name="WormholeWebhook")
-                        if webhook.id not in self.bot.webhooks:
-                            self.bot.webhooks.append(webhook.id)
-                        content_to_send = content + attachments + sticker_content if attachments or sticker_content or mentions else content
-                        tasks.append(webhook.send(
-                            content=content_to_send,
-                            username=display_name + f" ({user_hash[:6]})",
-                            avatar_url=avatar,
-                            embeds=message.embeds if message.embeds and message.author.bot else [],
-                            allowed_mentions=discord.AllowedMentions(everyone=False)
-                        ))
-
-                        # check if the channel is in the disconnected channels list
-                        disconnected_channel = f"{channel.name} in {channel.guild.name}"
-                        if disconnected_channel in self.bot.disconnected_channels:
-                            self.bot.disconnected_channels.remove(disconnected_channel)
-                    else:
-                        tasks.append(channel.send(
-                            f":warning: I need the 'Manage Webhooks' permission in this server to send/receive wormhole messages."
-                        ))
-                        disconnected_channel = f"{channel.name} in {channel.guild.name}"
-                        self.bot.disconnected_channels.add(disconnected_channel)
-
-            real_messages = []
-            messages = await asyncio.gather(*tasks, return_exceptions=True)
-            content = content + attachments + sticker_content
-            await self.bot.redis_publish(display_name, user_hash, content, embeds, stickers_to_send, channel_category)
-            for result in messages:
-                if isinstance(result, discord.Message):
-                    real_messages.append(result)
-                elif isinstance(result, Exception):
-                    # URL('https://discord.com/api/v10/channels/<channel_id>/messages')
-                    if result.status == 403: # Forbidden
-                        await self.bot.config.remove_channel(result.response.url.parts[4])
-            message_links = [message.jump_url for message in real_messages]
-            await self.bot.config.append_link(message_hash, message_links)
-            await self.handle_config_post(channel_config, message)
-
-            if channel_category == "wormhole":
-                await self.bot.redis_publish(display_name, user_hash, content, embeds, stickers_to_send, channel_category)
-
-            if self.bot.irc_client and self.bot.irc_client.connection.is_connected():
-                header = self.bot.format_irc_header(display_name, user_hash)
-                await self.bot.send_irc_message_parts(
-                    self.bot.irc_client.connection,
-                    channel_category,
-                    header,
-                    content,
-                    message.attachments,
-                    sticker_content
+            relay = await self.build_relay(message, user['hash'], channel_category)
+
+            if channel_config["react"]:
+                self.bot.reactions.submit(self.handle_config_pre, channel_config, message)
+
+            coalesce_ms = channel_config.get("coalesce_ms") or 0
+            if coalesce_ms > 0 and not relay.webhook_embeds:
+                await self.coalescer.add((user_id, channel_category, channel_id), coalesce_ms, {
+                    "content": relay.webhook_content,
+                    "message": message,
+                    "message_hash": message_hash,
+                    "channel_config": channel_config,
+                    "peers": channels,
+                    "username": relay.username,
+                    "avatar_url": relay.avatar_url
+                })
+            else:
+                deliveries = await self.fire_deliveries(
+                    message.channel.id,
+                    channels,
+                    content_for=relay.webhook_content_for if relay.reply_entry else None,
+                    content=relay.webhook_content,
+                    username=relay.username,
+                    avatar_url=relay.avatar_url,
+                    embeds=relay.webhook_embeds
                 )
+                self.track_deliveries([(message_hash, channel_config, message)], deliveries)
+
+            self.bot.bookkeeping.submit(self.record_message, user_id, message_hash, relay.display_name, relay.avatar_url)
+            if self.bot.pretty_message.console_mirror:
+                self.bot.pretty_message.create_rich_message_box(relay.display_name, message.content, relay.attachments, relay.user_hash)
+
+            if self.bot.bridge_bus.wants(channel_category):
+                self.bot.bridge_bus.publish(relay.envelope)
+
+    async def record_message(self, user_id: str, message_hash: str, display_name: str, avatar: str):
+        await self.bot.config.add_message_history(user_id, message_hash)
+        await self.bot.config.update_user_avatar(user_id, avatar)
+        await self.bot.config.add_username(user_id, display_name)
+
+    async def build_relay(self, message: discord.Message, user_hash: str, channel_category: str) -> RelayMessage:
+        reply_entry = None
+        reference = message.reference
+        if reference and reference.message_id:
+            reply_entry = await self.bot.config.get_mirror_entry(str(reference.channel_id), str(reference.message_id))
+        return RelayMessage(message, self.bot.pretty_message, user_hash, channel_category, reply_entry)
+
+    async def fire_deliveries(self, source_channel_id: int, channels: list, content_for=None, **kwargs) -> list:
+        # Returns (channel, dispatcher future) pairs; awaiting submit() only waits when a destination queue is full
+        deliveries = []
+        for channel_id in channels:
+            if int(channel_id) == source_channel_id:
+                continue
+            channel = self.bot.get_channel(int(channel_id))
+            if channel:
+                if self.bot.permissions.can_relay(channel):
+                    if content_for:
+                        kwargs["content"] = content_for(str(channel_id))
+                    deliveries.append((channel, await self.bot.dispatcher.submit(str(channel.id), functools.partial(
+                        self.bot.webhook_registry.send,
+                        channel,
+                        wait=True,
+                        allowed_mentions=discord.AllowedMentions(everyone=False),
+                        **kwargs
+                    ))))
+                elif self.bot.permissions.should_warn(channel.id):
+                    deliveries.append((channel, await self.bot.dispatcher.submit(str(channel.id), functools.partial(
+                        channel.send,
+                        f":warning: I need the 'Manage Webhooks' permission in this server to send/receive wormhole messages."
+                    ))))
+            else:
+                # Counts towards the channel's breaker, so channels the bot has lost access to get pruned
+                await self.bot.dispatcher.report_failure(str(channel_id), "Channel not found")
+        return deliveries
+
+    def track_deliveries(self, sources: list, deliveries: list):
+        task = asyncio.create_task(self.await_deliveries(sources, deliveries))
+        self.pending_deliveries.add(task)
+        task.add_done_callback(self.pending_deliveries.discard)
+
+    async def await_deliveries(self, sources: list, deliveries: list):
+        message_links = []
+        results = await asyncio.gather(*(future for _, future in deliveries), return_exceptions=True)
+        for (channel, _), result in zip(deliveries, results):
+            # Permission warnings are plain channel messages, not mirrors, and failures
+            # are tracked per destination by the dispatcher's circuit breakers
+            if isinstance(result, discord.WebhookMessage):
+                # Messages sent through a partial webhook have no guild, so their jump_url points at @me
+                message_links.append(f"https://discord.com/channels/{channel.guild.id}/{channel.id}/{result.id}")
+
+        # Only the database writes go through the bookkeeping queue
+        self.bot.bookkeeping.submit(self.record_deliveries, sources, message_links)
+
+    async def record_deliveries(self, sources: list, message_links: list):
+        # Every source message points at the post it ended up in, merged or not
+        for message_hash, channel_config, message in sources:
+            await self.bot.config.record_mirrors(
+                message_hash,
+                message.jump_url,
+                message_links,
+                author=message.author.display_name,
+                content=message.content,
+                shared=len(sources) > 1
+            )
+            if channel_config["react"]:
+                self.bot.reactions.submit(self.handle_config_post, channel_config, message)
+
+    async def flush_coalesced(self, key: tuple, parts: list):
+        last = parts[-1]
+        try:
+            deliveries = await self.fire_deliveries(
+                last["message"].channel.id,
+                last["peers"],
+                content=MessageCoalescer.merge(parts),
+                username=last["username"],
+                avatar_url=last["avatar_url"],
+                embeds=[]
+            )
+            sources = [(part["message_hash"], part["channel_config"], part["message"]) for part in parts]
+            self.track_deliveries(sources, deliveries)
+        except Exception as e:
+            self.bot.logger.error(f"Error relaying {len(parts)} coalesced messages: {str(e)}")
+
+    async def find_source_entry(self, channel_id: str, message_id: str):
+        # Only relayed messages that own their mirrors outright can be edited or deleted through them
+        if not await self.bot.config.get_channel_by_id(channel_id):
+            return None
+        entry = await self.bot.config.get_mirror_entry(channel_id, message_id)
+        if not entry or entry["shared"]:
+            return None
+        link = entry["links"].get(channel_id)
+        if not link or not link[2] or link[1] != message_id:
+            return None
+        return entry
+
+    async def apply_to_mirrors(self, entry: dict, action, content_for=None):
+        deliveries = []
+        for channel_id, (_, message_id, source) in entry["links"].items():
+            channel = self.bot.get_channel(int(channel_id))
+            if source or not channel:
+                continue
+            kwargs = {}
+            if content_for:
+                kwargs = {"content": content_for(channel_id), "allowed_mentions": discord.AllowedMentions(everyone=False)}
+            deliveries.append(await self.bot.dispatcher.submit(channel_id, functools.partial(
+                action, channel, int(message_id), **kwargs
+            )))
+
+        for result in await asyncio.gather(*deliveries, return_exceptions=True):
+            if isinstance(result, Exception) and not isinstance(result, discord.NotFound):
+                self.bot.logger.error(f"Failed to update a mirrored message: {str(result)}")
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        message = payload.message
+        if message.author == self.bot.user or message.webhook_id in self.bot.webhooks:
+            return
+
+        entry = await self.find_source_entry(str(payload.channel_id), str(payload.message_id))
+        # Link previews also arrive as edits; only propagate when the text actually changed
+        if not entry or message.edited_at is None or entry["content"] == message.content:
+            return
+
+        entry["content"] = message.content
+        user_hash = await self.bot.config.get_user_hash(str(message.author.id))
+        relay = await self.build_relay(message, user_hash, "")
+        await self.apply_to_mirrors(entry, self.bot.webhook_registry.edit_message, relay.webhook_content_for)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        await self.propagate_delete(str(payload.channel_id), str(payload.message_id))
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        for message_id in payload.message_ids:
+            await self.propagate_delete(str(payload.channel_id), str(message_id))
+
+    async def propagate_delete(self, channel_id: str, message_id: str):
+        entry = await self.find_source_entry(channel_id, message_id)
+        if not entry:
+            return
+        self.bot.config.forget_mirror_entry(entry)
+        await self.apply_to_mirrors(entry, self.bot.webhook_registry.delete_message)
+
+    # Permission snapshot invalidation
+    # --------------------------------
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        # Category overwrites flow down to synced channels
+        if isinstance(after, discord.CategoryChannel):
+            self.bot.permissions.invalidate_guild(after.guild.id)
+        else:
+            self.bot.permissions.invalidate_channel(after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self.bot.permissions.invalidate_channel(channel.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        self.bot.permissions.invalidate_guild(after.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        self.bot.permissions.invalidate_guild(role.guild.id)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if after.id == self.bot.user.id:
+            self.bot.permissions.invalidate_guild(after.guild.id)
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild):
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import time
+
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+MESSAGE_LIMIT = 2000
+
+
+class PendingBurst:
+    def __init__(self):
+        self.parts: List[Dict[str, Any]] = []
+        self.length = 0
+        self.started = time.monotonic()
+        self.timer: asyncio.Task = None
+
+    def fits(self, content: str, limit: int) -> bool:
+        # Parts are joined with a newline
+        return not self.parts or self.length + 1 + len(content) <= limit
+
+    def add(self, part: Dict[str, Any]) -> None:
+        self.length += len(part["content"]) + (1 if self.parts else 0)
+        self.parts.append(part)
+
+
+# Holds back messages from one author in one category for a short window so a burst of them goes
+# out as a single post per destination. Each new message restarts the window, but no burst is held
+# longer than COALESCE_MAX_HOLD_MS (or one window, if that is longer) after its first message, and
+# a burst is flushed early when the next message would push it over Discord's message length limit.
+class MessageCoalescer:
+    def __init__(self,
+                 flush: Callable[[Hashable, List[Dict[str, Any]]], Awaitable[None]],
+                 limit: int = MESSAGE_LIMIT,
+                 max_hold_ms: int = None):
+        self.flush = flush
+        self.limit = limit
+        self.max_hold_ms = max_hold_ms if max_hold_ms is not None else int(os.getenv("COALESCE_MAX_HOLD_MS", "5000"))
+        self.pending: Dict[Hashable, PendingBurst] = {}
+
+    async def add(self, key: Hashable, window_ms: int, part: Dict[str, Any]) -> None:
+        burst = self.pending.get(key)
+        if burst and not burst.fits(part["content"], self.limit):
+            await self._flush(key)
+            burst = None
+
+        if burst is None:
+            burst = self.pending[key] = PendingBurst()
+        elif burst.timer:
+            burst.timer.cancel()
+
+        burst.add(part)
+        held = time.monotonic() - burst.started
+        delay = min(window_ms, max(self.max_hold_ms, window_ms) - held * 1000) / 1000
+        burst.timer = asyncio.create_task(self._flush_later(key, burst, max(0.0, delay)))
+
+    async def _flush_later(self, key: Hashable, burst: PendingBurst, delay: float) -> None:
+        await asyncio.sleep(delay)
+        if self.pending.get(key) is burst:
+            # Detach the timer first so _flush doesn't cancel the task it is running in
+            burst.timer = None
+            await self._flush(key)
+
+    async def _flush(self, key: Hashable) -> None:
+        burst = self.pending.pop(key, None)
+        if not burst:
+            return
+        if burst.timer:
+            burst.timer.cancel()
+        await self.flush(key, burst.parts)
+
+    async def flush_all(self) -> None:
+        for key in list(self.pending):
+            await self._flush(key)
+
+    @staticmethod
+    def merge(parts: List[Dict[str, Any]]) -> str:
+        return "\n".join(part["content"] for part in parts)
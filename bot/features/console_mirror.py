@@ -0,0 +1,50 @@
+import logging
+import os
+import queue
+import threading
+
+from rich.console import Console
+
+
+# Prints relayed messages to the terminal from a dedicated thread so the event loop never waits
+# on Rich layout or stdout. Disabled unless CONSOLE_MIRROR=1; when enabled, only every Nth message
+# is rendered (CONSOLE_MIRROR_SAMPLE) and messages are dropped while the render queue is full.
+class ConsoleMirror:
+    def __init__(self, render, sample: int = None, max_size: int = None):
+        self.render = render
+        self.logger = logging.getLogger('wormhole')
+        self.sample = max(1, sample or int(os.getenv("CONSOLE_MIRROR_SAMPLE", "1")))
+        self.queue: queue.Queue = queue.Queue(maxsize=max_size or int(os.getenv("CONSOLE_MIRROR_QUEUE_SIZE", "256")))
+        self.console = Console()
+        self.seen = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name="console-mirror", daemon=True)
+        self.thread.start()
+
+    def submit(self, *args) -> None:
+        self.seen += 1
+        if self.seen % self.sample:
+            return
+        try:
+            self.queue.put_nowait(args)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            args = self.queue.get()
+            if args is None:
+                return
+            try:
+                self.console.print(self.render(*args))
+                self.console.print()
+            except Exception as e:
+                self.logger.error(f"Console mirror failed to render a message: {str(e)}")
+
+    def stop(self) -> None:
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            # The thread is a daemon, so it won't hold up shutdown
+            return
+        self.thread.join(timeout=1)
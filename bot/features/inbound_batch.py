@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import discord
+
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from bot.utils.envelope import Envelope
+
+# Discord's embed limits
+MAX_FIELDS = 25
+MAX_FIELD_NAME = 256
+MAX_FIELD_VALUE = 1024
+MAX_DESCRIPTION = 4096
+MAX_TITLE = 256
+MAX_TOTAL = 6000
+FOOTER = "SSH-Chat"
+
+
+def truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def field_for(envelope: Envelope) -> Tuple[str, str]:
+    name = truncate(f"{envelope.username} · {envelope.user_hash}", MAX_FIELD_NAME)
+    value = truncate(envelope.ssh_chat_text(), MAX_FIELD_VALUE) or "\u200b"
+    return name, value
+
+
+def build_ssh_chat_embed(envelopes: List[Envelope]) -> discord.Embed:
+    if len(envelopes) == 1:
+        # A lone line keeps the layout ssh-chat messages have always had
+        envelope = envelopes[0]
+        embed = discord.Embed(
+            title=truncate(envelope.username, MAX_TITLE),
+            description=truncate(envelope.ssh_chat_text(), MAX_DESCRIPTION),
+            color=discord.Color.green()
+        )
+        embed.set_footer(text=f"{FOOTER} - {envelope.user_hash}")
+        return embed
+
+    embed = discord.Embed(color=discord.Color.green())
+    for envelope in envelopes:
+        name, value = field_for(envelope)
+        embed.add_field(name=name, value=value, inline=False)
+    embed.set_footer(text=FOOTER)
+    return embed
+
+
+class InboundBatch:
+    def __init__(self):
+        self.lines: List[Tuple[Envelope, asyncio.Future]] = []
+        self.size = len(FOOTER)
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def fits(self, size: int) -> bool:
+        return not self.lines or (len(self.lines) < MAX_FIELDS and self.size + size <= MAX_TOTAL)
+
+
+# Collects ssh-chat lines per category for SSH_CHAT_FLUSH_MS and delivers them as one embed, so a
+# busy room costs one request per destination per window instead of one per line. The window is
+# fixed from a batch's first line (a steady conversation still flushes), and a batch goes out
+# early once another line would break the embed limits. add() returns a future that settles when
+# the line's batch has been handed to every destination.
+class InboundBatcher:
+    def __init__(self, deliver: Callable[[str, List[Envelope]], Awaitable[None]], window_ms: Optional[int] = None):
+        self.deliver = deliver
+        self.logger = logging.getLogger('wormhole')
+        self.window = (window_ms if window_ms is not None else int(os.getenv("SSH_CHAT_FLUSH_MS", "500"))) / 1000
+        self.pending: Dict[str, InboundBatch] = {}
+        self.deliveries: Set[asyncio.Task] = set()
+        self.lines = 0
+        self.batches = 0
+
+    def add(self, envelope: Envelope) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        key = envelope.category
+        name, value = field_for(envelope)
+        size = len(name) + len(value)
+
+        batch = self.pending.get(key)
+        if batch and not batch.fits(size):
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = self.pending[key] = InboundBatch()
+            batch.timer = loop.call_later(self.window, self._flush_window, key, batch)
+
+        future = loop.create_future()
+        batch.lines.append((envelope, future))
+        batch.size += size
+        self.lines += 1
+        return future
+
+    def _flush_window(self, key: str, batch: InboundBatch) -> None:
+        if self.pending.get(key) is batch:
+            self._flush(key)
+
+    def _flush(self, key: str) -> None:
+        batch = self.pending.pop(key, None)
+        if not batch:
+            return
+        if batch.timer:
+            batch.timer.cancel()
+        task = asyncio.create_task(self._deliver(key, batch))
+        self.deliveries.add(task)
+        task.add_done_callback(self.deliveries.discard)
+
+    async def _deliver(self, key: str, batch: InboundBatch) -> None:
+        self.batches += 1
+        try:
+            await self.deliver(key, [envelope for envelope, _ in batch.lines])
+        except Exception as e:
+            self.logger.error(f"Failed to deliver {len(batch.lines)} ssh-chat line(s) to {key}: {str(e)}")
+            for _, future in batch.lines:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch.lines:
+            if not future.done():
+                future.set_result(None)
+
+    async def flush_all(self) -> None:
+        for key in list(self.pending):
+            self._flush(key)
+        await asyncio.gather(*self.deliveries, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": sum(len(batch.lines) for batch in self.pending.values()),
+            "lines": self.lines,
+            "batches": self.batches,
+        }
@@ -1,30 +1,14 @@
+import os
 import discord
 from bot.config import WormholeConfig
-from rich.console import Console
+from bot.features.console_mirror import ConsoleMirror
 from rich.panel import Panel
 from rich.table import Table
 
 class PrettyMessage:
     def __init__(self, config: WormholeConfig):
         self.config = config
-    
-    async def to_embed( self, 
-                        user_id: int, 
-                        display_name: str,
-                        avatar: str,
-                        message: str
-        ) -> discord.Embed:
-
-        user_id = str(user_id)
-        user_color = await self.config.get_user_color(user_id)
-        user_hash = await self.config.get_user_hash(user_id)
-        embed = discord.Embed(
-            description = message,
-            color = user_color
-        )
-        embed.set_author(name=display_name, icon_url=avatar)
-        embed.set_footer(text=f"{user_hash}")
-        return embed
+        self.console_mirror = ConsoleMirror(self.build_message_box) if os.getenv("CONSOLE_MIRROR", "0") == "1" else None
     
     def to_attachments_message(self, attachments: list) -> str:
         if not attachments:
@@ -40,7 +24,7 @@ class PrettyMessage:
         embed_urls = [embed.url or "" for embed in embeds]
         return "\n".join(embed_urls)
 
-    async def handle_stickers(self, message: discord.Message) -> tuple:
+    def handle_stickers(self, message: discord.Message) -> tuple:
         stickers_to_send = []
         content_addition = ""
         
@@ -60,6 +44,11 @@ class PrettyMessage:
         return stickers_to_send, content_addition
     
     def create_rich_message_box(self, author, content, attachments, user_id, console_width=None):
+        # Never renders on the caller's thread: the mirror thread does the layout and printing
+        if self.console_mirror:
+            self.console_mirror.submit(author, content, attachments, user_id, console_width)
+
+    def build_message_box(self, author, content, attachments, user_id, console_width=None) -> Panel:
         min_width = len(user_id)
 
         if console_width and console_width < min_width:
@@ -67,25 +56,22 @@ class PrettyMessage:
         else:
             width = max(min_width, console_width or 0)
         
-        console = Console(width=width)
         table = Table(show_header=False, show_edge=False, pad_edge=True, box=None)
         table.add_column("Content", style="cyan", no_wrap=True, min_width=width, max_width=width+len(content))
         table.add_row(content)
         if attachments:
             table.add_row("")
             table.add_row("[bold]Attachments:[/bold]")
-            for attachment in attachments:
+            for attachment in attachments.splitlines():
                 table.add_row(attachment)
 
-        message_panel = Panel(
+        return Panel(
             table,
             title=f"[bold yellow]{author}[/bold yellow]",
             subtitle=f"[dim]{user_id}[/dim]",
             expand=False,
             border_style="blue"
         )
-        console.print(message_panel)
-        console.print()
     
     def format_mentions(self, mentions: list) -> str:
         if not mentions:
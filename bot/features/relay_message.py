@@ -0,0 +1,124 @@
+import discord
+
+from typing import Dict, List, Optional, Tuple
+from bot.features.pretty_message import PrettyMessage
+from bot.utils.envelope import Envelope
+
+
+# One incoming message as seen by the relay. Every representation (webhook text, attachment links,
+# sticker text, bridge envelope) is built on first use and kept, so a sink only pays for what it reads.
+class RelayMessage:
+    __slots__ = (
+        "message", "pretty", "user_hash", "category", "reply_entry",
+        "_reply_text", "_content", "_attachments", "_attachment_urls", "_stickers", "_webhook_content", "_envelope"
+    )
+
+    def __init__(self, message: discord.Message, pretty: PrettyMessage, user_hash: str, category: str,
+                 reply_entry: Optional[Dict] = None):
+        self.message = message
+        self.pretty = pretty
+        self.user_hash = user_hash
+        self.category = category
+        # Mirror index entry of the message being replied to, if it was relayed
+        self.reply_entry = reply_entry
+        self._reply_text: Optional[str] = None
+        self._content: Optional[str] = None
+        self._attachments: Optional[str] = None
+        self._attachment_urls: Optional[List[str]] = None
+        self._stickers: Optional[Tuple[list, str]] = None
+        self._webhook_content: Optional[str] = None
+        self._envelope: Optional[Envelope] = None
+
+    @property
+    def display_name(self) -> str:
+        return self.message.author.display_name
+
+    @property
+    def avatar_url(self) -> str:
+        return self.message.author.display_avatar.url
+
+    @property
+    def username(self) -> str:
+        return self.display_name + f" ({self.user_hash[:6]})"
+
+    @property
+    def reply_text(self) -> str:
+        # Quotable text of the replied-to message, from discord.py's cache or the mirror index
+        if self._reply_text is None:
+            text = ""
+            reference = self.message.reference
+            if reference and isinstance(reference.resolved, discord.Message):
+                text = reference.resolved.content
+            elif self.reply_entry and self.reply_entry["content"]:
+                text = self.reply_entry["content"]
+            self._reply_text = text.replace("\n", "\n> ")
+        return self._reply_text
+
+    @property
+    def content(self) -> str:
+        # Message text with the replied-to message quoted above it
+        if self._content is None:
+            self._content = f"> {self.reply_text}\n{self.message.content}" if self.reply_text else self.message.content
+        return self._content
+
+    @property
+    def attachments(self) -> str:
+        if self._attachments is None:
+            self._attachments = self.pretty.to_attachments_message(self.message.attachments)
+        return self._attachments
+
+    @property
+    def attachment_urls(self) -> List[str]:
+        if self._attachment_urls is None:
+            self._attachment_urls = [attachment.url for attachment in self.message.attachments]
+        return self._attachment_urls
+
+    @property
+    def stickers(self) -> list:
+        return self._sticker_parts()[0]
+
+    @property
+    def sticker_content(self) -> str:
+        return self._sticker_parts()[1]
+
+    def _sticker_parts(self) -> Tuple[list, str]:
+        if self._stickers is None:
+            self._stickers = self.pretty.handle_stickers(self.message) if self.message.stickers else ([], "")
+        return self._stickers
+
+    @property
+    def webhook_content(self) -> str:
+        if self._webhook_content is None:
+            self._webhook_content = self.content + self.attachments + self.sticker_content
+        return self._webhook_content
+
+    def webhook_content_for(self, channel_id: str) -> str:
+        # Replies link to the copy of the replied-to message that lives in the destination channel
+        link = self.reply_entry["links"].get(channel_id) if self.reply_entry else None
+        if not link:
+            return self.webhook_content
+
+        server_id, message_id, _ = link
+        url = f"https://discord.com/channels/{server_id}/{channel_id}/{message_id}"
+        quote = f"> [↪]({url}) {self.reply_text}" if self.reply_text else f"> [↪ reply]({url})"
+        return f"{quote}\n{self.message.content}" + self.attachments + self.sticker_content
+
+    @property
+    def webhook_embeds(self) -> list:
+        # Only other bots' embeds are forwarded as embeds; users' link previews regenerate on their own
+        return self.message.embeds if self.message.embeds and self.message.author.bot else []
+
+    @property
+    def envelope(self) -> Envelope:
+        if self._envelope is None:
+            self._envelope = Envelope(
+                username=self.display_name,
+                user_hash=self.user_hash,
+                content=self.content,
+                category=self.category,
+                attachments=self.attachment_urls,
+                sticker_content=self.sticker_content,
+                has_embeds=bool(self.message.embeds),
+                has_stickers=bool(self.stickers)
+            )
+        return self._envelope
@@ -0,0 +1,347 @@
+import argparse
+import asyncio
+import logging
+import math
+import time
+
+import asyncpg
+
+from bot.config import WormholeConfig, create_tables, ensure_legacy_partition, ensure_partitions, get_partitions
+from bot.utils.logging import setup_logging
+
+logger = logging.getLogger('wormhole')
+
+
+async def backfill_message_links(pool, batch_size: int = 5000) -> int:
+    # Copies the legacy MessageHistory.message_link array into MessageLinks, one keyset batch per statement
+    async with pool.acquire() as conn:
+        column_type = await conn.fetchval(
+            """
+            SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'messagehistory' AND column_name = 'message_link'
+            """
+        )
+        if column_type is None:
+            return 0
+
+        # create_tables makes MessageLinks partitioned from the current period on, so the
+        # historical timestamps copied here need a partition to land in
+        await ensure_legacy_partition(conn, "MessageLinks", "messagelinks_legacy")
+
+        links = "batch.message_link" if column_type == "ARRAY" else "ARRAY[batch.message_link]"
+        last_hash = ""
+        total = 0
+        while True:
+            result = await conn.fetchrow(
+                f"""
+                WITH batch AS (
+                    SELECT hash, message_link, timestamp FROM MessageHistory
+                    WHERE hash > $1
+                    ORDER BY hash
+                    LIMIT $2
+                ),
+                inserted AS (
+                    INSERT INTO MessageLinks (hash, server_id, channel_id, message_id, timestamp)
+                    SELECT batch.hash, split_part(link, '/', 5), split_part(link, '/', 6), split_part(link, '/', 7), batch.timestamp
+                    FROM batch, unnest({links}) AS link
+                    WHERE link LIKE 'https://%/channels/%/%/%'
+                    ON CONFLICT DO NOTHING
+                    RETURNING 1
+                )
+                SELECT (SELECT MAX(hash) FROM batch) AS last_hash, (SELECT COUNT(*) FROM inserted) AS inserted
+                """,
+                last_hash, batch_size
+            )
+            if result['last_hash'] is None:
+                break
+
+            last_hash = result['last_hash']
+            total += result['inserted']
+            logger.info(f"Backfilled {total} message links (up to {last_hash[:12]})")
+
+        return total
+
+
+# Columns each table keeps through partitioning; anything else on the legacy table is dropped.
+# MessageHistory.message_link is kept so older readers still work until migration 10 drops it.
+PARTITION_LAYOUTS = {
+    "MessageHistory": {
+        "columns": ("hash", "message_link", "user_id", "timestamp"),
+        "key": "hash, timestamp",
+        "user_fk": True,
+        "indexes": ()
+    },
+    "AttachmentHistory": {
+        "columns": ("hash", "attachment_link", "user_id", "timestamp"),
+        "key": "hash, timestamp",
+        "user_fk": True,
+        "indexes": ()
+    },
+    "MessageLinks": {
+        "columns": ("hash", "server_id", "channel_id", "message_id", "source", "timestamp"),
+        "key": "channel_id, message_id, timestamp",
+        "user_fk": False,
+        "indexes": (("messagelinks_hash_idx", "hash"),)
+    },
+}
+
+
+async def partition_history_tables(pool, span: float, days_ahead: float = 14) -> None:
+    # Turns each plain history table into a range-partitioned parent. The existing table is attached
+    # whole as the partition covering everything before the current period, so no rows are copied
+    # and retention later drops it like any other partition.
+    async with pool.acquire() as conn:
+        for table, layout in PARTITION_LAYOUTS.items():
+            relkind = await conn.fetchval(
+                """
+                SELECT relkind::text FROM pg_class WHERE oid = to_regclass($1)
+                """,
+                table.lower()
+            )
+            if relkind != 'r':
+                continue
+
+            legacy = f"{table.lower()}_legacy"
+            cutoff = (math.floor(time.time() / span) + 1) * span
+            started = time.monotonic()
+
+            # Done outside the swap transaction so the expensive parts only take weak locks:
+            # the unique index ATTACH adopts for the new key, and the CHECK that lets it skip its scan
+            await conn.execute(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {legacy}_key ON {table} ({layout['key']})")
+            await conn.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {legacy}_range")
+            await conn.execute(f"ALTER TABLE {table} ADD CONSTRAINT {legacy}_range CHECK (timestamp < {cutoff}) NOT VALID")
+            await conn.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {legacy}_range")
+
+            async with conn.transaction():
+                # A partition can't keep a primary key of its own; {legacy}_key takes its place
+                primary_key = await conn.fetchval(
+                    """
+                    SELECT conname FROM pg_constraint WHERE conrelid = to_regclass($1) AND contype = 'p'
+                    """,
+                    table.lower()
+                )
+                if primary_key:
+                    await conn.execute(f"ALTER TABLE {table} DROP CONSTRAINT {primary_key}")
+
+                indexes = await conn.fetch(
+                    """
+                    SELECT indexname FROM pg_indexes WHERE tablename = $1
+                    """,
+                    table.lower()
+                )
+                columns = await conn.fetch(
+                    """
+                    SELECT column_name FROM information_schema.columns WHERE table_name = $1
+                    """,
+                    table.lower()
+                )
+
+                await conn.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+                for index in indexes:
+                    if "_legacy" not in index['indexname']:
+                        await conn.execute(f"ALTER INDEX {index['indexname']} RENAME TO {index['indexname']}_legacy")
+                for column in columns:
+                    if column['column_name'] not in layout['columns']:
+                        await conn.execute(f"ALTER TABLE {legacy} DROP COLUMN {column['column_name']}")
+
+                await conn.execute(f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)")
+                await conn.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({layout['key']})")
+                if layout['user_fk']:
+                    await conn.execute(f"ALTER TABLE {table} ADD FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE")
+                for name, column in layout['indexes']:
+                    await conn.execute(f"CREATE INDEX {name} ON {table} ({column})")
+
+                await conn.execute(f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ({cutoff})")
+                await conn.execute(f"ALTER TABLE {legacy} DROP CONSTRAINT {legacy}_range")
+
+            await ensure_partitions(conn, table, cutoff, cutoff + days_ahead * 86400, span)
+            logger.info(f"Partitioned {table} in {time.monotonic() - started:.2f}s")
+
+
+async def _drop_invalid_index(conn, name: str) -> None:
+    # An interrupted CREATE INDEX CONCURRENTLY leaves an INVALID index behind that IF NOT EXISTS would keep
+    invalid = await conn.fetchval(
+        """
+        SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)
+        """,
+        name
+    )
+    if invalid:
+        await conn.execute(f"DROP INDEX CONCURRENTLY {name}")
+
+
+async def create_index_concurrently(pool, name: str, table: str, columns: str) -> None:
+    async with pool.acquire() as conn:
+        partitions = await get_partitions(conn, table)
+        if partitions is None:
+            await _drop_invalid_index(conn, name)
+            await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+            return
+
+        # Partitioned parents cannot be indexed concurrently, so build each partition's index
+        # concurrently and attach it; the parent index becomes valid once every partition has one
+        await conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} ({columns})")
+        suffix = name[len(table) + 1:] if name.startswith(f"{table.lower()}_") else name
+        for partition, _, _ in partitions:
+            child = f"{partition}_{suffix}"
+            await _drop_invalid_index(conn, child)
+            await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} ({columns})")
+            await conn.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+
+async def channels_server_id_varchar(pool, config: WormholeConfig) -> None:
+    # Guild ids do not fit in INT, and join_channel already passes them as strings
+    async with pool.acquire() as conn:
+        data_type = await conn.fetchval(
+            """
+            SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'channels' AND column_name = 'server_id'
+            """
+        )
+        if data_type == "integer":
+            await conn.execute("ALTER TABLE Channels ALTER COLUMN server_id TYPE VARCHAR(255)")
+
+
+async def users_hash_prefix_idx(pool, config: WormholeConfig) -> None:
+    await create_index_concurrently(pool, "users_hash_prefix_idx", "Users", "hash text_pattern_ops")
+
+
+async def channels_category_idx(pool, config: WormholeConfig) -> None:
+    await create_index_concurrently(pool, "channels_category_idx", "Channels", "channel_category")
+
+
+async def message_links_backfill(pool, config: WormholeConfig) -> None:
+    total = await backfill_message_links(pool)
+    logger.info(f"Message link backfill complete: {total} links")
+
+
+async def partition_history(pool, config: WormholeConfig) -> None:
+    await partition_history_tables(pool, config.partition_span, config.partitions_ahead_days)
+
+
+async def messagehistory_user_id_idx(pool, config: WormholeConfig) -> None:
+    await create_index_concurrently(pool, "messagehistory_user_id_idx", "MessageHistory", "user_id")
+
+
+async def messagehistory_timestamp_idx(pool, config: WormholeConfig) -> None:
+    await create_index_concurrently(pool, "messagehistory_timestamp_idx", "MessageHistory", "timestamp")
+
+
+async def channels_coalesce_ms(pool, config: WormholeConfig) -> None:
+    async with pool.acquire() as conn:
+        await conn.execute("ALTER TABLE Channels ADD COLUMN IF NOT EXISTS coalesce_ms INT DEFAULT 0")
+
+
+async def message_links_source(pool, config: WormholeConfig) -> None:
+    # Marks the row for the message that was relayed, as opposed to its mirrors
+    async with pool.acquire() as conn:
+        await conn.execute("ALTER TABLE MessageLinks ADD COLUMN IF NOT EXISTS source BOOLEAN DEFAULT FALSE")
+
+
+async def drop_messagehistory_message_link(pool, config: WormholeConfig) -> None:
+    # The links live in MessageLinks once message_links_backfill (4) has copied them over
+    async with pool.acquire() as conn:
+        await conn.execute("ALTER TABLE MessageHistory DROP COLUMN IF EXISTS message_link")
+
+
+# Append only: a version is never reused once it has shipped
+MIGRATIONS = [
+    (1, "channels_server_id_varchar", channels_server_id_varchar),
+    (2, "users_hash_prefix_idx", users_hash_prefix_idx),
+    (3, "channels_category_idx", channels_category_idx),
+    (4, "message_links_backfill", message_links_backfill),
+    (5, "partition_history", partition_history),
+    (6, "messagehistory_user_id_idx", messagehistory_user_id_idx),
+    (7, "messagehistory_timestamp_idx", messagehistory_timestamp_idx),
+    (8, "channels_coalesce_ms", channels_coalesce_ms),
+    (9, "message_links_source", message_links_source),
+    # Must stay after message_links_backfill (4), which reads the column
+    (10, "drop_messagehistory_message_link", drop_messagehistory_message_link),
+]
+
+MIGRATION_LOCK_ID = 0x576f726d  # "Worm"
+MIGRATION_LOCK_POLL = 1.0
+
+
+async def get_applied_migrations(conn) -> dict:
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS SchemaMigrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at FLOAT NOT NULL,
+            duration FLOAT NOT NULL
+        )
+        """
+    )
+    rows = await conn.fetch("SELECT * FROM SchemaMigrations")
+    return {row['version']: dict(row) for row in rows}
+
+
+async def run_migrations(config: WormholeConfig) -> int:
+    applied_count = 0
+    async with config.pool.acquire() as lock_conn:
+        # Serialises replicas starting at the same time; the others wait and then find nothing to do.
+        # Polled rather than a blocking pg_advisory_lock: a waiter blocked inside that statement holds a
+        # snapshot, and CREATE INDEX CONCURRENTLY in the holder's steps would wait on it forever.
+        waiting = False
+        while not await lock_conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_ID):
+            if not waiting:
+                logger.info("Waiting for another replica to finish migrating")
+                waiting = True
+            await asyncio.sleep(MIGRATION_LOCK_POLL)
+        try:
+            applied = await get_applied_migrations(lock_conn)
+            for version, name, step in MIGRATIONS:
+                if version in applied:
+                    continue
+
+                logger.info(f"Applying migration {version}: {name}")
+                started = time.monotonic()
+                await step(config.pool, config)
+                duration = time.monotonic() - started
+                await lock_conn.execute(
+                    """
+                    INSERT INTO SchemaMigrations (version, name, applied_at, duration)
+                    VALUES ($1, $2, $3, $4)
+                    """,
+                    version, name, time.time(), duration
+                )
+                logger.info(f"Applied migration {version}: {name} in {duration:.2f}s")
+                applied_count += 1
+        finally:
+            await lock_conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+    return applied_count
+
+
+async def list_migrations(config: WormholeConfig) -> None:
+    async with config.pool.acquire() as conn:
+        applied = await get_applied_migrations(conn)
+    for version, name, _ in MIGRATIONS:
+        if version in applied:
+            print(f"{version:>4}  {name:<32} applied in {applied[version]['duration']:.2f}s")
+        else:
+            print(f"{version:>4}  {name:<32} pending")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Apply Wormhole schema migrations")
+    parser.add_argument("--list", action="store_true", help="show applied and pending migrations")
+    args = parser.parse_args()
+
+    config = WormholeConfig()
+    config.pool = await asyncpg.create_pool(config.db_url)
+    try:
+        await create_tables(config.pool)
+        if args.list:
+            await list_migrations(config)
+        else:
+            applied = await run_migrations(config)
+            logger.info(f"{applied} migration(s) applied")
+    finally:
+        await config.pool.close()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(main())
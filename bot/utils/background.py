@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import os
+import time
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+# Runs fire-and-forget work (database bookkeeping, reactions, bridge sends) off the relay path.
+# The queue is bounded: when it is full new jobs are dropped and counted rather than letting
+# pending coroutines pile up, and failures are logged and counted instead of surfacing to callers.
+class BackgroundQueue:
+    def __init__(self, name: str, max_size: Optional[int] = None, workers: int = 1):
+        self.name = name
+        self.logger = logging.getLogger('wormhole')
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size or int(os.getenv("BACKGROUND_QUEUE_SIZE", "1000")))
+        self.worker_count = workers
+        self.workers: List[asyncio.Task] = []
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self.last_drop_logged = 0.0
+
+    def submit(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> bool:
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+        try:
+            self.queue.put_nowait((func, args, kwargs))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            # Under sustained overload this would otherwise log once per message
+            now = time.monotonic()
+            if now - self.last_drop_logged > 10:
+                self.last_drop_logged = now
+                self.logger.warning(f"Background queue {self.name} is full, {self.dropped} job(s) dropped so far")
+            return False
+
+    async def _worker(self) -> None:
+        while True:
+            func, args, kwargs = await self.queue.get()
+            try:
+                await func(*args, **kwargs)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                self.last_error = f"{func.__name__}: {str(e)}"
+                self.logger.error(f"Background job {func.__name__} failed in {self.name}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "max_size": self.queue.maxsize,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+        }
+
+    async def close(self, timeout: float = 5) -> None:
+        # Give queued jobs a chance to finish before shutdown
+        if self.workers:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                self.logger.warning(f"Background queue {self.name} closed with {self.queue.qsize()} job(s) pending")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
@@ -0,0 +1,192 @@
+import functools
+import json
+import struct
+import time
+
+from typing import List, Optional, Union
+
+# Binary layout (version 2): a fixed header, then `attachment_count` unsigned shorts with each
+# attachment URL's length, then every field's UTF-8 bytes back to back in header order followed by
+# the attachments. Lengths count bytes and integers are network byte order. Bump VERSION on any
+# layout change so older decoders reject new frames instead of misreading them.
+MAGIC = b"WH"
+VERSION = 2
+HEADER = struct.Struct("!2sBBdHHHHHHHI")
+
+@functools.lru_cache(maxsize=32)
+def attachment_struct(count: int) -> struct.Struct:
+    return struct.Struct(f"!{count}H")
+
+
+FLAG_EMBEDS = 1
+FLAG_STICKERS = 2
+
+EMBED_MARKER = "<embed>"
+STICKER_MARKER = "<sticker>"
+
+
+# One relayed message in a network-neutral form, built once in on_message and handed to every
+# bridge sink so each only formats what it needs. `origin` names the bot instance that first
+# relayed it, so a message that comes back around a bridge can be recognised and dropped.
+class Envelope:
+    def __init__(self,
+                 username: str,
+                 user_hash: str,
+                 content: str,
+                 category: str,
+                 attachments: Optional[List[str]] = None,
+                 sticker_content: str = "",
+                 has_embeds: bool = False,
+                 has_stickers: bool = False,
+                 source: str = "discord",
+                 origin: str = "",
+                 timestamp: Optional[float] = None):
+        self.username = username
+        self.user_hash = user_hash
+        self.content = content
+        self.category = category
+        self.attachments = attachments or []
+        self.sticker_content = sticker_content
+        self.has_embeds = has_embeds
+        self.has_stickers = has_stickers
+        self.source = source
+        self.origin = origin
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    @property
+    def header(self) -> str:
+        return f"[{self.username}] ({self.user_hash[:6]})"
+
+    def full_text(self) -> str:
+        return self.content + "\n".join(self.attachments) + self.sticker_content
+
+    def ssh_chat_text(self) -> str:
+        message = self.full_text()
+        if self.has_embeds:
+            message += EMBED_MARKER
+        if self.has_stickers:
+            message += STICKER_MARKER
+        return message
+
+    def to_json(self) -> str:
+        # "username", "hash" and "message" are what ssh-chat has always consumed and older readers
+        # ignore the rest; "content" marks a payload that carries every field separately
+        return json.dumps({
+            "username": self.username,
+            "hash": self.user_hash,
+            "message": self.ssh_chat_text(),
+            "content": self.content,
+            "attachments": self.attachments,
+            "sticker_content": self.sticker_content,
+            "has_embeds": self.has_embeds,
+            "has_stickers": self.has_stickers,
+            "category": self.category,
+            "source": self.source,
+            "origin": self.origin,
+            "timestamp": self.timestamp
+        })
+
+    @classmethod
+    def from_json(cls, data: Union[str, bytes], category: str = "wormhole", source: str = "ssh-chat") -> "Envelope":
+        payload = json.loads(data)
+        if not isinstance(payload, dict):
+            raise ValueError(f"Expected a JSON object, got {type(payload).__name__}")
+
+        if "content" in payload:
+            return cls(
+                username=str(payload.get("username", "Unknown User")),
+                user_hash=str(payload.get("hash", "No hash")),
+                content=str(payload["content"]),
+                category=str(payload.get("category", category)),
+                attachments=[str(attachment) for attachment in payload.get("attachments") or []],
+                sticker_content=str(payload.get("sticker_content", "")),
+                has_embeds=bool(payload.get("has_embeds")),
+                has_stickers=bool(payload.get("has_stickers")),
+                source=str(payload.get("source", source)),
+                origin=str(payload.get("origin", "")),
+                timestamp=float(payload["timestamp"]) if payload.get("timestamp") is not None else None
+            )
+
+        message = str(payload.get("message", "No message"))
+        # Older producers mark embeds and stickers by appending a marker to the text
+        has_stickers = message.endswith(STICKER_MARKER)
+        if has_stickers:
+            message = message[:-len(STICKER_MARKER)]
+        has_embeds = message.endswith(EMBED_MARKER)
+        if has_embeds:
+            message = message[:-len(EMBED_MARKER)]
+        return cls(
+            username=str(payload.get("username", "Unknown User")),
+            user_hash=str(payload.get("hash", "No hash")),
+            content=message,
+            category=category,
+            has_embeds=has_embeds,
+            has_stickers=has_stickers,
+            source=source,
+            origin=str(payload.get("origin", ""))
+        )
+
+    def encode(self) -> bytes:
+        fields = [field.encode("utf-8") for field in (self.source, self.category, self.username, self.user_hash,
+                                                      self.origin, self.sticker_content, self.content)]
+        attachments = [attachment.encode("utf-8") for attachment in self.attachments]
+        flags = (FLAG_EMBEDS if self.has_embeds else 0) | (FLAG_STICKERS if self.has_stickers else 0)
+        try:
+            header = HEADER.pack(MAGIC, VERSION, flags, self.timestamp, *map(len, fields[:-1]),
+                                 len(attachments), len(fields[-1]))
+            lengths = attachment_struct(len(attachments)).pack(*map(len, attachments)) if attachments else b""
+        except struct.error as e:
+            raise ValueError(f"Envelope field too long: {str(e)}")
+        return b"".join((header, lengths, *fields, *attachments))
+
+    @classmethod
+    def decode(cls, data: Union[str, bytes], category: str = "wormhole", source: str = "ssh-chat") -> "Envelope":
+        # Binary envelopes are recognised by their magic; anything else is the JSON format, whose
+        # category and source are implied by the channel it arrived on when the payload omits them
+        if isinstance(data, str) or not data.startswith(MAGIC):
+            return cls.from_json(data, category=category, source=source)
+
+        try:
+            (_, version, flags, timestamp, source_length, category_length, username_length, hash_length,
+             origin_length, sticker_length, attachment_count, content_length) = HEADER.unpack_from(data)
+            if version != VERSION:
+                raise ValueError(f"Unsupported envelope version {version}")
+            attachment_lengths = attachment_struct(attachment_count).unpack_from(data, HEADER.size) if attachment_count else ()
+        except struct.error as e:
+            raise ValueError(f"Truncated envelope: {str(e)}")
+
+        end = HEADER.size + 2 * attachment_count
+        start, end = end, end + source_length
+        source = data[start:end].decode("utf-8")
+        start, end = end, end + category_length
+        category = data[start:end].decode("utf-8")
+        start, end = end, end + username_length
+        username = data[start:end].decode("utf-8")
+        start, end = end, end + hash_length
+        user_hash = data[start:end].decode("utf-8")
+        start, end = end, end + origin_length
+        origin = data[start:end].decode("utf-8")
+        start, end = end, end + sticker_length
+        sticker_content = data[start:end].decode("utf-8")
+        start, end = end, end + content_length
+        content = data[start:end].decode("utf-8")
+        attachments = []
+        for length in attachment_lengths:
+            start, end = end, end + length
+            attachments.append(data[start:end].decode("utf-8"))
+        if end != len(data):
+            raise ValueError(f"Envelope length mismatch: expected {end} bytes, got {len(data)}")
+
+        return cls(
+            username=username,
+            user_hash=user_hash,
+            content=content,
+            category=category,
+            attachments=attachments,
+            sticker_content=sticker_content,
+            has_embeds=bool(flags & FLAG_EMBEDS),
+            has_stickers=bool(flags & FLAG_STICKERS),
+            source=source,
+            origin=origin,
+            timestamp=timestamp
+        )
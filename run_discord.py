@@ -1,7 +1,9 @@
 import asyncio
 import os
 from bot.config import WormholeConfig, initialize_database
+from bot.migrations import run_migrations
 from services.discord import DiscordBot
+from services.supervisor import Supervisor
 from services.tox import ToxService
 from bot.utils.logging import setup_logging
 
@@ -11,25 +13,27 @@ async def main():
 
     config = WormholeConfig()
     await initialize_database(config)
+    if os.getenv("RUN_MIGRATIONS", "1") == "1":
+        await run_migrations(config)
     
     discord_bot = DiscordBot(config)
-    tox_service = ToxService(config)
+    supervisor = Supervisor()
+    if os.getenv("TOX_SERVICE", "0") == "1":
+        tox_service = ToxService(config, redis_pool=discord_bot.redis_pool)
+        supervisor.spawn("tox", tox_service.start)
+    else:
+        tox_service = None
     
     try:
+        # The bot handles its own gateway reconnects; supervised services run beside it and are
+        # restarted if they crash, but the process exits when the bot does
         await discord_bot.start()
-        # If you want to start both services concurrently, uncomment the following:
-        # await asyncio.gather(
-        #     discord_bot.start(),
-        #     tox_service.start()
-        # )
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received. Shutting down...")
     finally:
-        # If you're running both services, uncomment the following:
-        # await asyncio.gather(
-        #     discord_bot.stop(),
-        #     tox_service.stop()
-        # )
+        await supervisor.stop()
+        if tox_service:
+            await tox_service.stop()
         if not discord_bot.is_closed():
             await discord_bot.close()
 
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import time
+import aiohttp
+import discord
+
+from typing import Dict, List, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class DestinationUnavailable(Exception):
+    def __init__(self, key: str):
+        super().__init__(f"Destination {key} is unavailable (circuit open)")
+        self.key = key
+
+
+# Discord JSON error codes for a 404 that means the channel or its webhook is gone. Other 404s, such
+# as Unknown Message (10008) when editing or deleting a mirror a moderator removed, say nothing
+# about the destination.
+UNKNOWN_CHANNEL = 10003
+UNKNOWN_WEBHOOK = 10015
+
+
+def is_destination_failure(error: BaseException) -> bool:
+    # Rate limits are the dispatcher's business; these mean the destination itself is broken
+    if isinstance(error, discord.HTTPException):
+        if error.status == 404:
+            return error.code in (UNKNOWN_CHANNEL, UNKNOWN_WEBHOOK)
+        return error.status in (401, 403) or error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError, OSError))
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.first_failure = 0.0
+        self.retry_at = 0.0
+        self.last_error: Optional[str] = None
+
+
+# One breaker per destination channel. After `threshold` consecutive failures a destination is
+# skipped until its backoff expires, then a single probe send decides whether it closes again or
+# reopens with twice the backoff. A destination that has been failing for longer than `prune_after`
+# seconds is reported dead so its channel can be removed.
+class DestinationBreakers:
+    def __init__(self):
+        self.threshold = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+        self.base_backoff = float(os.getenv("BREAKER_BASE_BACKOFF", "30"))
+        self.max_backoff = float(os.getenv("BREAKER_MAX_BACKOFF", "3600"))
+        self.prune_after = float(os.getenv("BREAKER_PRUNE_AFTER", "86400"))
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def allow(self, key: str) -> bool:
+        breaker = self.breakers.get(key)
+        if breaker is None or breaker.state == CLOSED:
+            return True
+        if breaker.state == OPEN and time.monotonic() >= breaker.retry_at:
+            breaker.state = HALF_OPEN
+            return True
+        return False
+
+    def is_open(self, key: str) -> bool:
+        breaker = self.breakers.get(key)
+        return breaker is not None and breaker.state == OPEN and time.monotonic() < breaker.retry_at
+
+    def record_success(self, key: str) -> None:
+        self.breakers.pop(key, None)
+
+    def record_failure(self, key: str, error: str) -> bool:
+        # Returns True once the destination has been failing long enough to be pruned
+        now = time.monotonic()
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker()
+            breaker.first_failure = now
+
+        breaker.failures += 1
+        breaker.last_error = error
+        if breaker.state == HALF_OPEN or breaker.failures >= self.threshold:
+            breaker.state = OPEN
+            breaker.opens += 1
+            breaker.retry_at = now + min(self.max_backoff, self.base_backoff * 2 ** (breaker.opens - 1))
+
+        return bool(self.prune_after) and breaker.state == OPEN and now - breaker.first_failure >= self.prune_after
+
+    def forget(self, key: str) -> None:
+        self.breakers.pop(key, None)
+
+    def summary(self) -> List[Dict]:
+        now = time.monotonic()
+        return [
+            {
+                "key": key,
+                "state": breaker.state,
+                "failures": breaker.failures,
+                "retry_in": max(0.0, breaker.retry_at - now) if breaker.state == OPEN else 0.0,
+                "failing_for": now - breaker.first_failure,
+                "last_error": breaker.last_error,
+            }
+            for key, breaker in self.breakers.items()
+        ]
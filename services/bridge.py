@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List
+from bot.utils.envelope import Envelope
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+
+
+class BridgeSink(ABC):
+    name = "sink"
+
+    def __init__(self, bot, max_size: int = 1000, batch_size: int = 1, policy: str = DROP_NEWEST):
+        self.bot = bot
+        self.logger = logging.getLogger('wormhole')
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.policy = policy
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.batches = 0
+        self.last_error = None
+
+    def accepts(self, category: str) -> bool:
+        return True
+
+    @abstractmethod
+    async def send_batch(self, envelopes: List[Envelope]) -> None:
+        ...
+
+    def offer(self, envelope: Envelope) -> None:
+        if self.queue.full():
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return
+            # DROP_OLDEST: make room so the most recent messages still get through
+            self.queue.get_nowait()
+            self.queue.task_done()
+        self.queue.put_nowait(envelope)
+
+    async def run(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.send_batch(batch)
+                self.sent += len(batch)
+                self.batches += 1
+            except Exception as e:
+                self.failed += len(batch)
+                self.last_error = str(e)
+                self.logger.error(f"Bridge sink {self.name} failed to send {len(batch)} message(s): {str(e)}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "last_error": self.last_error,
+        }
+
+
+class SshChatSink(BridgeSink):
+    name = "ssh-chat"
+
+    def __init__(self, bot, **kwargs):
+        super().__init__(bot, **kwargs)
+        # ssh-chat reads JSON; "binary" is for consumers that understand the versioned envelope codec
+        self.encoding = os.getenv("BRIDGE_ENCODING", "json")
+
+    def encode(self, envelope: Envelope):
+        return envelope.encode() if self.encoding == "binary" else envelope.to_json()
+
+    def accepts(self, category: str) -> bool:
+        return category == "wormhole"
+
+    async def send_batch(self, envelopes: List[Envelope]) -> None:
+        if not self.bot.redis:
+            raise ConnectionError("No Redis connection")
+        async with self.bot.redis.pipeline(transaction=False) as pipe:
+            for envelope in envelopes:
+                if self.bot.redis_streams:
+                    pipe.xadd(
+                        self.bot.redis_ssh_stream,
+                        {"data": self.encode(envelope)},
+                        maxlen=self.bot.redis_stream_maxlen,
+                        approximate=True
+                    )
+                else:
+                    pipe.publish(self.bot.redis_ssh_channel, self.encode(envelope))
+            await pipe.execute()
+
+
+class IrcSink(BridgeSink):
+    name = "irc"
+
+    def accepts(self, category: str) -> bool:
+        return self.bot.irc_client is not None
+
+    async def send_batch(self, envelopes: List[Envelope]) -> None:
+        if not self.bot.irc_client or not self.bot.irc_client.connection.is_connected():
+            raise ConnectionError("IRC is not connected")
+        connection = self.bot.irc_client.connection
+        for envelope in envelopes:
+            channel = f"#{envelope.category}"
+            if envelope.content.strip():
+                connection.privmsg(channel, self.bot.format_content_message(envelope.header, envelope.content))
+            if envelope.sticker_content:
+                connection.privmsg(channel, self.bot.format_sticker_message(envelope.header, envelope.sticker_content))
+            for attachment in envelope.attachments:
+                connection.privmsg(channel, self.bot.format_attachment_message(envelope.header, attachment))
+
+
+class ToxSink(BridgeSink):
+    name = "tox"
+
+    def __init__(self, bot, **kwargs):
+        super().__init__(bot, **kwargs)
+        self.channel = os.getenv("TOX_CHANNEL", "tox_node")
+        self.category = os.getenv("TOX_CATEGORY", "wormhole")
+
+    def accepts(self, category: str) -> bool:
+        return category == self.category
+
+    async def send_batch(self, envelopes: List[Envelope]) -> None:
+        if not self.bot.redis:
+            raise ConnectionError("No Redis connection")
+        async with self.bot.redis.pipeline(transaction=False) as pipe:
+            for envelope in envelopes:
+                # The Tox node hands the payload to tox_friend_send_message as-is, so it gets plain text
+                pipe.publish(self.channel, f"{envelope.header}: {envelope.full_text()}")
+            await pipe.execute()
+
+
+# Fans one Envelope out to every registered sink. publish() never waits: each sink has its own
+# bounded queue and worker, so a slow or disconnected network only fills (and drops from) its own queue.
+class BridgeBus:
+    def __init__(self, origin: str = ""):
+        self.origin = origin
+        self.sinks: List[BridgeSink] = []
+        self.workers: List[asyncio.Task] = []
+
+    def register(self, sink: BridgeSink) -> None:
+        self.sinks.append(sink)
+        if self.workers:
+            self.workers.append(asyncio.create_task(sink.run()))
+
+    def start(self) -> None:
+        if not self.workers:
+            self.workers = [asyncio.create_task(sink.run()) for sink in self.sinks]
+
+    def wants(self, category: str) -> bool:
+        # Lets callers skip building an envelope that no sink would take
+        return any(sink.accepts(category) for sink in self.sinks)
+
+    def publish(self, envelope: Envelope) -> None:
+        if not envelope.origin:
+            envelope.origin = self.origin
+        for sink in self.sinks:
+            if sink.accepts(envelope.category):
+                sink.offer(envelope)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {sink.name: sink.stats() for sink in self.sinks}
+
+    async def close(self, timeout: float = 5) -> None:
+        if self.workers:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(sink.queue.join() for sink in self.sinks)), timeout)
+            except asyncio.TimeoutError:
+                pass
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
@@ -1,17 +1,29 @@
 import asyncio
+import functools
 import json
 import os
+import random
+import socket
+import time
 import traceback
+import uuid
 import discord
 import redis.asyncio as redis
 import irc.client_aio
 
 from discord.ext import commands, tasks
 from typing import Dict, List, Optional
-from bot.config import WormholeConfig
+from bot.config import AmbiguousHashError, WormholeConfig
+from bot.utils.background import BackgroundQueue
 from bot.utils.logging import setup_logging
 from bot.features.pretty_message import PrettyMessage
 from bot.features.embed import create_embed
+from bot.features.inbound_batch import InboundBatcher, build_ssh_chat_embed
+from bot.utils.envelope import Envelope
+from services.bridge import DROP_OLDEST, BridgeBus, IrcSink, SshChatSink, ToxSink
+from services.dispatcher import SendDispatcher
+from services.permissions import PermissionSnapshots
+from services.webhooks import WebhookRegistry
 
 class DiscordBot(commands.Bot):
     def __init__(self, config: WormholeConfig):
@@ -28,15 +40,48 @@ class DiscordBot(commands.Bot):
 
         self.redis: Optional[redis.Redis] = None
         self.redis_url = os.getenv("REDIS_HOST_URL", "redis://localhost:6379")
+        # Shared with in-process services such as ToxService so they don't each open their own connections
+        self.redis_pool = redis.ConnectionPool.from_url(self.redis_url)
         self.redis_channel = os.getenv("REDIS_DISCORD_CHANNEL", "wormhole-discord")
         self.redis_ssh_channel = os.getenv("REDIS_SSH_CHANNEL", "wormhole-ssh-chat")
+        self.redis_invalidation_channel = os.getenv("REDIS_INVALIDATION_CHANNEL", "wormhole-invalidation")
+        self.redis_backoff_base = float(os.getenv("REDIS_BACKOFF_BASE", "0.5"))
+        self.redis_backoff_max = float(os.getenv("REDIS_BACKOFF_MAX", "30"))
+        self.redis_listener_task: Optional[asyncio.Task] = None
+        # "streams" trades the fire-and-forget pub/sub bridge for at-least-once delivery through a
+        # consumer group, so replicas share the inbound load and restarts don't lose messages
+        self.redis_streams = os.getenv("REDIS_TRANSPORT", "pubsub") == "streams"
+        self.redis_discord_stream = os.getenv("REDIS_DISCORD_STREAM", self.redis_channel)
+        self.redis_ssh_stream = os.getenv("REDIS_SSH_STREAM", self.redis_ssh_channel)
+        self.redis_stream_group = os.getenv("REDIS_STREAM_GROUP", "wormhole-bot")
+        self.redis_stream_consumer = os.getenv("REDIS_STREAM_CONSUMER", socket.gethostname())
+        self.redis_stream_maxlen = int(os.getenv("REDIS_STREAM_MAXLEN", "10000"))
+        self.redis_stream_batch = int(os.getenv("REDIS_STREAM_BATCH", "50"))
+        self.redis_stream_block_ms = int(os.getenv("REDIS_STREAM_BLOCK_MS", "5000"))
+        self.redis_stream_claim_idle_ms = int(os.getenv("REDIS_STREAM_CLAIM_IDLE_MS", "60000"))
+        self.redis_stream_task: Optional[asyncio.Task] = None
+        self.instance_id = uuid.uuid4().hex
+        self.config.invalidation_publisher = self.publish_invalidation
+        self.history_retention_days = int(os.getenv("HISTORY_RETENTION_DAYS", "0"))
         self.irc_server = os.getenv("IRC_SERVER")
         self.irc_port = int(os.getenv("IRC_PORT"))
         self.irc_nickname = os.getenv("IRC_NICKNAME")
         self.irc_client = None
         self.setup_once = False
-        self.webhooks = []
-        self.disconnected_channels = set()
+        self.webhooks = self.config.webhook_ids
+        self.webhook_registry = WebhookRegistry(self)
+        self.dispatcher = SendDispatcher()
+        self.permissions = PermissionSnapshots()
+        self.dispatcher.on_dead = self.prune_destination
+        # Work that on_message hands off so it can return as soon as deliveries are queued.
+        # Reactions keep a single worker so the pending and done reactions stay in order.
+        self.bookkeeping = BackgroundQueue("bookkeeping", workers=4)
+        self.reactions = BackgroundQueue("reactions")
+        self.ssh_chat_batcher = InboundBatcher(self.deliver_ssh_chat_batch)
+        self.bridge_bus = BridgeBus(origin=self.instance_id)
+        self.bridge_bus.register(SshChatSink(self, batch_size=50))
+        self.bridge_bus.register(IrcSink(self, batch_size=10))
+        self.bridge_bus.register(ToxSink(self, batch_size=50, policy=DROP_OLDEST))
 
     def format_attachments(self, attachments) -> str:
         if not attachments:
@@ -64,8 +109,8 @@ class DiscordBot(commands.Bot):
     def format_irc_header(self, display_name: str, user_hash: str) -> str:
         return f"[{display_name}] ({user_hash[:6]})"
 
-    def format_attachment_message(self, header: str, attachment) -> str:
-        return f"{header}: [Attachment: {attachment.url}]"
+    def format_attachment_message(self, header: str, attachment_url: str) -> str:
+        return f"{header}: [Attachment: {attachment_url}]"
 
     def format_sticker_message(self, header: str, sticker_content: str) -> str:
         return f"{header}: {sticker_content}"
@@ -73,17 +118,6 @@ class DiscordBot(commands.Bot):
     def format_content_message(self, header: str, content: str) -> str:
         return f"{header}: {content}"
 
-    async def send_irc_message_parts(self, connection, channel: str, header: str, 
-                                   content: str, attachments, sticker_content: str):
-        if content.strip():
-            connection.privmsg(f"#{channel}", self.format_content_message(header, content))
-        
-        if sticker_content:
-            connection.privmsg(f"#{channel}", self.format_sticker_message(header, sticker_content))
-
-        for attachment in attachments:
-            connection.privmsg(f"#{channel}", self.format_attachment_message(header, attachment))
-
     async def _setup_last_messages_dict(self) -> None:
         channel_categories: list[str] = await self.config.get_channel_list()
         self.last_messages = {category: set() for category in channel_categories}
@@ -101,6 +135,17 @@ class DiscordBot(commands.Bot):
             self.logger.info("Last messages dict set up.")
             self.redis_reconnect_task.start()
             self.logger.info("Redis reconnect task started.")
+            self.redis_listener_task = asyncio.create_task(self.redis_listener())
+            self.logger.info("Redis listener started.")
+            if self.redis_streams:
+                self.redis_stream_task = asyncio.create_task(self.redis_stream_listener())
+                self.logger.info("Redis stream consumer started.")
+            self.profile_flush_task.start()
+            self.logger.info("Profile flush task started.")
+            self.history_maintenance_task.start()
+            self.logger.info("History maintenance task started.")
+            self.bridge_bus.start()
+            self.logger.info("Bridge bus started.")
 
     @tasks.loop(seconds=30)
     async def redis_reconnect_task(self):
@@ -113,87 +158,247 @@ class DiscordBot(commands.Bot):
             self.logger.warning("Lost connection to Redis. Attempting to reconnect...")
             await self.connect_to_redis()
 
+    @tasks.loop(seconds=float(os.getenv("PROFILE_FLUSH_INTERVAL", "5")))
+    async def profile_flush_task(self):
+        try:
+            await self.config.flush_profile_updates()
+        except Exception as e:
+            self.logger.error(f"Failed to flush profile updates: {str(e)}")
+
+    @tasks.loop(hours=1)
+    async def history_maintenance_task(self):
+        try:
+            await self.config.ensure_history_partitions()
+            if self.history_retention_days > 0:
+                await self.config.clear_old_messages(self.history_retention_days)
+        except Exception as e:
+            self.logger.error(f"History maintenance failed: {str(e)}")
+
     async def connect_to_redis(self):
         try:
-            self.redis = await redis.from_url(self.redis_url)
+            self.redis = redis.Redis(connection_pool=self.redis_pool)
+            await self.redis.ping()
             self.logger.info("Connected to Redis successfully.")
-            self.loop.create_task(self.redis_listener())
         except redis.RedisError as e:
             self.logger.error(f"Failed to connect to Redis: {str(e)}")
             self.redis = None
 
-    async def redis_publish(self, name: str, user_hash: str, content: str, embeds, stickers_to_send, channel_category) -> None:
+    async def prune_destination(self, channel_id: str) -> None:
+        self.logger.warning(f"Removing channel {channel_id} from the network after failing for {self.dispatcher.breakers.prune_after:.0f}s")
+        await self.config.remove_channel(channel_id)
+        self.permissions.invalidate_channel(int(channel_id))
+
+    async def publish_invalidation(self, scope: str) -> None:
         if not self.redis:
-            self.logger.error("Cannot publish to Redis: No connection")
-            return
-        elif channel_category != "wormhole":
             return
 
-        message = content
-        if embeds:
-            message += "<embed>"
-        if stickers_to_send:
-            message += "<sticker>"
-        
         data = {
-            "username": name,
-            "hash": user_hash,
-            "message": message
+            "origin": self.instance_id,
+            "scope": scope
         }
         try:
-            await self.redis.publish(self.redis_ssh_channel, json.dumps(data))
+            await self.redis.publish(self.redis_invalidation_channel, json.dumps(data))
         except redis.RedisError as e:
-            self.logger.error(f"Failed to publish to Redis: {str(e)}")
+            self.logger.error(f"Failed to publish invalidation to Redis: {str(e)}")
 
-    async def redis_listener(self):
-        self.logger.info(f"Starting Redis listener on channel: {self.redis_channel}")
+    async def handle_invalidation_message(self, message) -> None:
         try:
-            async with self.redis.pubsub() as pubsub:
-                await pubsub.subscribe(self.redis_channel)
-                self.logger.info(f"Subscribed to Redis channel: {self.redis_channel}")
-                
-                while True:
-                    try:
-                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-                        if message:
-                            await self.handle_redis_message(message['data'])
-                    except redis.RedisError as e:
-                        self.logger.error(f"Redis error in listener: {str(e)}")
-                        await asyncio.sleep(5)  # Wait before attempting to reconnect
-                        break
+            data = json.loads(message)
+            if data.get("origin") == self.instance_id:
+                return
+            await self.config.handle_invalidation(data.get("scope", "all"))
         except Exception as e:
-            self.logger.error(f"Error in Redis listener: {str(e)}")
+            self.logger.error(f"Error handling invalidation message: {str(e)}")
             self.logger.error(traceback.format_exc())
-        finally:
-            if self.redis:
-                await self.redis.close()
-            self.redis = None
 
-    async def handle_redis_message(self, message):
-        try:
-            decoded_message = message.decode('utf-8')
-            message_info = json.loads(decoded_message)
-            channels = await self.config.get_channels_by_category("wormhole")
-            if channels:
-                tasks = []
-                for channel in channels:
-                    _channel = self.get_channel(int(channel['channel_id']))
-                    if not _channel:
-                        continue
-                    embed = discord.Embed(
-                        title=f"{message_info.get('username', 'Unknown User')}",
-                        description=f"{message_info.get('message', 'No message')}",
-                        color=discord.Color.green()
+    async def redis_backoff(self, backoff: float, name: str) -> float:
+        delay = backoff * random.uniform(0.5, 1.5)
+        self.logger.info(f"Reconnecting {name} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        return min(backoff * 2, self.redis_backoff_max)
+
+    async def redis_listener(self):
+        # Runs for the bot's lifetime on its own client, so a broken subscription never takes the
+        # publishing connection down with it and is re-established without waiting for a timer
+        channels = [self.redis_invalidation_channel]
+        if not self.redis_streams:
+            channels.append(self.redis_channel)
+
+        backoff = self.redis_backoff_base
+        while True:
+            subscriber = redis.from_url(self.redis_url, health_check_interval=30)
+            try:
+                async with subscriber.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(*channels)
+                    self.logger.info(f"Subscribed to Redis channels: {', '.join(channels)}")
+                    backoff = self.redis_backoff_base
+                    # Invalidations published while we were disconnected are lost, so resync once subscribed
+                    await self.config.handle_invalidation("all")
+
+                    async for message in pubsub.listen():
+                        if message['type'] != 'message':
+                            continue
+                        if message['channel'].decode('utf-8') == self.redis_invalidation_channel:
+                            await self.handle_invalidation_message(message['data'])
+                        else:
+                            await self.handle_redis_message(message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"Redis listener disconnected: {str(e)}")
+            finally:
+                await subscriber.aclose()
+
+            backoff = await self.redis_backoff(backoff, "Redis listener")
+
+    # Redis Streams
+    # ---
+
+    async def redis_stream_listener(self):
+        # Entries stay pending in the group until they have been fanned out, so anything this
+        # consumer read before a crash is replayed on reconnect and entries held by a replica that
+        # went away are claimed once they have been idle for REDIS_STREAM_CLAIM_IDLE_MS
+        backoff = self.redis_backoff_base
+        while True:
+            consumer = redis.from_url(self.redis_url, health_check_interval=30)
+            try:
+                await self.ensure_stream_group(consumer)
+                self.logger.info(f"Consuming Redis stream {self.redis_discord_stream} as {self.redis_stream_consumer}")
+                backoff = self.redis_backoff_base
+                await self.replay_pending_entries(consumer)
+
+                last_claim = 0.0
+                while True:
+                    if time.monotonic() - last_claim >= self.redis_stream_claim_idle_ms / 1000:
+                        await self.claim_stale_entries(consumer)
+                        last_claim = time.monotonic()
+                    response = await consumer.xreadgroup(
+                        self.redis_stream_group,
+                        self.redis_stream_consumer,
+                        {self.redis_discord_stream: ">"},
+                        count=self.redis_stream_batch,
+                        block=self.redis_stream_block_ms
                     )
-                    embed.set_footer(text=f"SSH-Chat - {message_info.get('hash', 'No hash')}")
-                    tasks.append(_channel.send(embed=embed))
-                await asyncio.gather(*tasks, return_exceptions=True)
+                    if response:
+                        await self.process_stream_entries(consumer, response[0][1])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"Redis stream consumer disconnected: {str(e)}")
+            finally:
+                await consumer.aclose()
+
+            backoff = await self.redis_backoff(backoff, "Redis stream consumer")
+
+    async def ensure_stream_group(self, client: redis.Redis) -> None:
+        try:
+            # A new group starts at the tail; from then on the group itself remembers what was delivered
+            await client.xgroup_create(self.redis_discord_stream, self.redis_stream_group, id="$", mkstream=True)
+            self.logger.info(f"Created Redis consumer group {self.redis_stream_group}")
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def replay_pending_entries(self, client: redis.Redis) -> None:
+        last_id = "0"
+        while True:
+            response = await client.xreadgroup(
+                self.redis_stream_group,
+                self.redis_stream_consumer,
+                {self.redis_discord_stream: last_id},
+                count=self.redis_stream_batch
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                return
+            self.logger.info(f"Replaying {len(entries)} pending stream entries")
+            await self.process_stream_entries(client, entries)
+            last_id = entries[-1][0]
+
+    async def claim_stale_entries(self, client: redis.Redis) -> None:
+        start_id = "0-0"
+        while True:
+            response = await client.xautoclaim(
+                self.redis_discord_stream,
+                self.redis_stream_group,
+                self.redis_stream_consumer,
+                min_idle_time=self.redis_stream_claim_idle_ms,
+                start_id=start_id,
+                count=self.redis_stream_batch
+            )
+            start_id, entries = response[0], response[1]
+            if entries:
+                self.logger.info(f"Claimed {len(entries)} stale stream entries")
+                await self.process_stream_entries(client, entries)
+            if start_id in (b"0-0", "0-0"):
+                return
+
+    async def process_stream_entries(self, client: redis.Redis, entries) -> None:
+        acked = []
+        queued = []
+        for entry_id, fields in entries:
+            try:
+                delivered = self.queue_ssh_chat_message(fields[b"data"])
+            except Exception as e:
+                # Decoding is deterministic, so an entry that fails here (bad JSON, a non-object
+                # payload, nil fields from a deleted entry) would fail on every replay; ack it instead
+                self.logger.error(f"Dropping malformed stream entry {entry_id}: {str(e)}")
+                acked.append(entry_id)
+                continue
+            if delivered is None:
+                acked.append(entry_id)
             else:
-                self.logger.error(f"Error sending log message: No wormhole channels found")
+                queued.append((entry_id, delivered))
+
+        # The whole read lands in the same flush window, so this waits for roughly one batch
+        results = await asyncio.gather(*(delivered for _, delivered in queued), return_exceptions=True)
+        for (entry_id, _), result in zip(queued, results):
+            if isinstance(result, Exception):
+                # Left pending: claim_stale_entries retries it once it has been idle long enough
+                self.logger.error(f"Error relaying stream entry {entry_id}: {str(result)}")
+                continue
+            acked.append(entry_id)
+
+        if acked:
+            await client.xack(self.redis_discord_stream, self.redis_stream_group, *acked)
+
+    async def handle_redis_message(self, message):
+        try:
+            delivered = self.queue_ssh_chat_message(message)
+            if delivered is not None:
+                # Failures are logged by the batcher; retrieving them keeps asyncio from warning again
+                delivered.add_done_callback(lambda future: future.cancelled() or future.exception())
         except Exception as e:
             self.logger.error(f"Error handling Redis message: {str(e)}")
             self.logger.error(traceback.format_exc())
 
+    def queue_ssh_chat_message(self, message) -> Optional[asyncio.Future]:
+        envelope = Envelope.decode(message, category="wormhole", source="ssh-chat")
+        if envelope.origin == self.instance_id:
+            # Our own relay echoed back by the bridge
+            return None
+        return self.ssh_chat_batcher.add(envelope)
+
+    async def deliver_ssh_chat_batch(self, category: str, envelopes: List[Envelope]) -> None:
+        channel_ids = await self.config.get_category_channel_ids(category)
+        if not channel_ids:
+            self.logger.error(f"Error sending log message: No {category} channels found")
+            return
+
+        embed = build_ssh_chat_embed(envelopes)
+        tasks = []
+        for channel_id in channel_ids:
+            _channel = self.get_channel(int(channel_id))
+            if not _channel:
+                continue
+            tasks.append(await self.dispatcher.submit(str(_channel.id), functools.partial(_channel.send, embed=embed)))
+        # Individual failures belong to the dispatcher's breakers, but if no destination took the
+        # batch it has not been delivered and stream entries must stay pending
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        failures = [result for result in results if isinstance(result, Exception)]
+        if failures and len(failures) == len(results):
+            raise ConnectionError(f"No {category} destination accepted the batch: {str(failures[0])}")
+
     async def before_message(self, message: discord.Message) -> None:
         if message.author == self.user:
             return
@@ -218,8 +423,31 @@ class DiscordBot(commands.Bot):
     async def close(self) -> None:
         self.logger.info("Stopping bot...")
         self.redis_reconnect_task.cancel()
+        if self.redis_listener_task:
+            self.redis_listener_task.cancel()
+        if self.redis_stream_task:
+            self.redis_stream_task.cancel()
+        self.profile_flush_task.cancel()
+        self.history_maintenance_task.cancel()
+        # Relayed messages still waiting on the dispatcher hand their mirror links to bookkeeping, and
+        # bookkeeping buffers profile updates, so both are drained while the dispatcher still runs
+        events = self.get_cog("EventHandlers")
+        if events:
+            await events.drain()
+        for queue in (self.bookkeeping, self.reactions):
+            await queue.close()
+        await self.bridge_bus.close()
+        await self.ssh_chat_batcher.flush_all()
+        if self.pretty_message.console_mirror:
+            self.pretty_message.console_mirror.stop()
+        await self.dispatcher.close()
+        try:
+            await self.config.flush_profile_updates()
+        except Exception as e:
+            self.logger.error(f"Failed to flush profile updates: {str(e)}")
         if self.redis:
-            await self.redis.close()
+            await self.redis.aclose()
+        await self.redis_pool.disconnect()
         if hasattr(self, 'log_observer'):
             self.log_observer.stop()
             self.log_observer.join()
@@ -260,6 +488,13 @@ class DiscordBot(commands.Bot):
     async def on_command_error(self, ctx, error):
         if isinstance(error, commands.CheckFailure):
             return
+        elif isinstance(getattr(error, "original", None), AmbiguousHashError):
+            await ctx.send(
+                embed=create_embed(
+                    title="Ambiguous Hash",
+                    description=str(error.original)
+                )
+            )
         elif isinstance(error, commands.CommandNotFound):
             await ctx.send(
                 embed=create_embed(
@@ -301,22 +536,20 @@ class DiscordBot(commands.Bot):
             for channel_data in channels:
                 channel = self.get_channel(int(channel_data['channel_id']))
                 if channel:
-                    permissions = channel.permissions_for(channel.guild.me)
-                    if permissions.manage_webhooks:
-                        webhooks = await channel.webhooks()
-                        webhook = discord.utils.get(webhooks, name="WormholeWebhook")
-                        if not webhook:
-                            webhook = await channel.create_webhook(name="WormholeWebhook")
-                        tasks.append(webhook.send(
+                    if self.permissions.can_relay(channel):
+                        tasks.append(await self.dispatcher.submit(str(channel.id), functools.partial(
+                            self.webhook_registry.send,
+                            channel,
                             content=message,
                             username=sender,
                             avatar_url="https://cdn.discordapp.com/attachments/1257498794069590017/1308758643407061013/19ba1725ab283c0ea5b844163e43cefd.png?ex=673f1bf8&is=673dca78&hm=f363368cf02dd73daf2a4ea18b9bedabab06ad984ca2e0bbe51bdadeb17fd5cb&",
                             allowed_mentions=discord.AllowedMentions(everyone=False)
-                        ))
-                    else:
-                        tasks.append(channel.send(
+                        )))
+                    elif self.permissions.should_warn(channel.id):
+                        tasks.append(await self.dispatcher.submit(str(channel.id), functools.partial(
+                            channel.send,
                             f":warning: I need the 'Manage Webhooks' permission in this server to send/receive wormhole messages."
-                        ))
+                        )))
             await asyncio.gather(*tasks, return_exceptions=True)
 
 class IRCClient(irc.client_aio.AioSimpleIRCClient):
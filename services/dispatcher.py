@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import time
+import discord
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+from services.breaker import DestinationBreakers, DestinationUnavailable, is_destination_failure
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self) -> float:
+        # Takes a token and returns 0, or returns how long to wait before asking again
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def update_from_headers(self, headers) -> None:
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After") or headers.get("Retry-After")
+        if reset_after is None:
+            return
+
+        reset_after = float(reset_after)
+        if remaining is not None and int(remaining) > 0:
+            self.tokens = min(self.tokens, float(remaining))
+        else:
+            self.tokens = 0
+            self.blocked_until = time.monotonic() + reset_after
+
+
+# Every destination (channel id) gets its own bounded queue drained by one worker and paced by a
+# token bucket, while a global semaphore caps how many requests are in flight. submit() waits while
+# a destination's queue is full, which pushes back on whatever produced the message.
+class SendDispatcher:
+    def __init__(self,
+                 concurrency: Optional[int] = None,
+                 queue_size: Optional[int] = None,
+                 rate: float = 2.5,
+                 burst: float = 5,
+                 idle_timeout: float = 60):
+        # Defaults follow Discord's webhook bucket of 5 requests per 2 seconds
+        concurrency = concurrency or int(os.getenv("DISPATCH_CONCURRENCY", "16"))
+        self.logger = logging.getLogger('wormhole')
+        self.queue_size = queue_size or int(os.getenv("DISPATCH_QUEUE_SIZE", "100"))
+        self.rate = rate
+        self.burst = burst
+        self.idle_timeout = idle_timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.workers: Dict[str, asyncio.Task] = {}
+        self.breakers = DestinationBreakers()
+        # Called with the destination key once its breaker says it has been dead long enough to prune
+        self.on_dead: Optional[Callable[[str], Awaitable[None]]] = None
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.skipped = 0
+
+    async def submit(self, key: str, send: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        if not self.breakers.allow(key):
+            # Dead destinations don't get a queue slot or rate-limit budget
+            self.skipped += 1
+            future = asyncio.get_running_loop().create_future()
+            future.set_exception(DestinationUnavailable(key))
+            return future
+
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = asyncio.Queue(maxsize=self.queue_size)
+            self.buckets.setdefault(key, TokenBucket(self.rate, self.burst))
+            self.workers[key] = asyncio.create_task(self._worker(key, queue))
+
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((send, future))
+        return future
+
+    async def _worker(self, key: str, queue: asyncio.Queue) -> None:
+        bucket = self.buckets[key]
+        while True:
+            try:
+                send, future = await asyncio.wait_for(queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                # Nothing queued: retire so idle destinations don't keep a task alive
+                del self.queues[key]
+                del self.workers[key]
+                return
+
+            dead = False
+            try:
+                # Jobs queued before the breaker opened are dropped rather than sent
+                if self.breakers.is_open(key):
+                    raise DestinationUnavailable(key)
+                while (delay := bucket.delay()) > 0:
+                    await asyncio.sleep(delay)
+                async with self.semaphore:
+                    result = await send()
+                self.sent += 1
+                self.breakers.record_success(key)
+                if not future.done():
+                    future.set_result(result)
+            except DestinationUnavailable as e:
+                self.skipped += 1
+                if not future.done():
+                    future.set_exception(e)
+            except Exception as e:
+                self.failed += 1
+                if isinstance(e, discord.HTTPException) and e.response is not None:
+                    if e.status == 429:
+                        self.rate_limited += 1
+                    bucket.update_from_headers(e.response.headers)
+                if is_destination_failure(e):
+                    dead = self.breakers.record_failure(key, str(e))
+                else:
+                    # The destination answered (e.g. a 429), so it is alive
+                    self.breakers.record_success(key)
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                queue.task_done()
+
+            if dead:
+                await self._prune(key)
+
+    async def report_failure(self, key: str, error: str) -> None:
+        # For failures found before anything is sent, e.g. a destination channel the bot can no longer see
+        if self.breakers.allow(key) and self.breakers.record_failure(key, error):
+            await self._prune(key)
+
+    async def _prune(self, key: str) -> None:
+        self.breakers.forget(key)
+        if self.on_dead:
+            try:
+                await self.on_dead(key)
+            except Exception as e:
+                self.logger.error(f"Failed to prune dead destination {key}: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "destinations": len(self.queues),
+            "queued": sum(queue.qsize() for queue in self.queues.values()),
+            "sent": self.sent,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "skipped": self.skipped,
+            "open": sum(1 for breaker in self.breakers.summary() if breaker["state"] != "closed"),
+        }
+
+    async def close(self) -> None:
+        for worker in self.workers.values():
+            worker.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.workers.clear()
+        self.queues.clear()
@@ -0,0 +1,56 @@
+import os
+import time
+import discord
+
+from typing import Dict, Set
+
+
+# The bot's resolved permissions per channel, so relays don't recompute role overwrites for every
+# message and destination. Entries are dropped when the channel, a role in its guild, or the bot's
+# own member changes; see the listeners in bot/events.py.
+class PermissionSnapshots:
+    def __init__(self):
+        self.snapshots: Dict[int, discord.Permissions] = {}
+        self.guild_channels: Dict[int, Set[int]] = {}
+        self.warned: Dict[int, float] = {}
+        self.warning_window = float(os.getenv("PERMISSION_WARNING_WINDOW", "3600"))
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, channel: discord.abc.GuildChannel) -> discord.Permissions:
+        permissions = self.snapshots.get(channel.id)
+        if permissions is not None:
+            self.hits += 1
+            return permissions
+
+        self.misses += 1
+        permissions = channel.permissions_for(channel.guild.me)
+        self.snapshots[channel.id] = permissions
+        self.guild_channels.setdefault(channel.guild.id, set()).add(channel.id)
+        return permissions
+
+    def can_relay(self, channel: discord.abc.GuildChannel) -> bool:
+        return self.get(channel).manage_webhooks
+
+    def invalidate_channel(self, channel_id: int) -> None:
+        self.snapshots.pop(channel_id, None)
+        self.warned.pop(channel_id, None)
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        for channel_id in self.guild_channels.pop(guild_id, ()):
+            self.invalidate_channel(channel_id)
+
+    def should_warn(self, channel_id: int) -> bool:
+        # One "missing permission" notice per channel per window instead of one per relayed message
+        now = time.monotonic()
+        if now - self.warned.get(channel_id, float("-inf")) < self.warning_window:
+            return False
+        self.warned[channel_id] = now
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.snapshots),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import os
+import random
+
+from typing import Awaitable, Callable, Dict
+
+
+# Runs long-lived services next to the Discord bot and restarts any that crash, backing off
+# exponentially (with jitter) while one keeps failing. A service that returns normally is done
+# and is not restarted.
+class Supervisor:
+    def __init__(self):
+        self.logger = logging.getLogger('wormhole')
+        self.backoff_base = float(os.getenv("SUPERVISOR_BACKOFF_BASE", "1"))
+        self.backoff_max = float(os.getenv("SUPERVISOR_BACKOFF_MAX", "60"))
+        # A run that lasted this long counts as healthy, so the next crash starts from the base backoff
+        self.healthy_after = float(os.getenv("SUPERVISOR_HEALTHY_AFTER", "60"))
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.restarts: Dict[str, int] = {}
+
+    def spawn(self, name: str, start: Callable[[], Awaitable[None]]) -> None:
+        self.restarts[name] = 0
+        self.tasks[name] = asyncio.create_task(self._supervise(name, start))
+
+    async def _supervise(self, name: str, start: Callable[[], Awaitable[None]]) -> None:
+        loop = asyncio.get_running_loop()
+        backoff = self.backoff_base
+        while True:
+            started = loop.time()
+            try:
+                await start()
+                self.logger.info(f"Service {name} finished")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Service {name} crashed: {str(e)}")
+
+            if loop.time() - started >= self.healthy_after:
+                backoff = self.backoff_base
+            delay = backoff * random.uniform(0.5, 1.5)
+            self.restarts[name] += 1
+            self.logger.info(f"Restarting service {name} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, self.backoff_max)
+
+    async def stop(self) -> None:
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
@@ -1,26 +1,52 @@
-import redis
+import asyncio
 import json
+import logging
+import os
+import random
+import redis.asyncio as redis
+
+from typing import Optional
 from bot.config import WormholeConfig
-from bot.utils.logging import setup_logging
 
+
+# Forwards messages published on TOX_INBOUND_CHANNEL to the Tox node's channel. Everything runs on
+# the event loop, and the client borrows connections from the pool it is given (the bot's, when run
+# from run_discord.py) instead of opening its own.
 class ToxService:
-    def __init__(self, config: WormholeConfig):
+    def __init__(self, config: WormholeConfig, redis_pool: Optional[redis.ConnectionPool] = None):
         self.config = config
-        self.logger = setup_logging()
-        self.redis_client = redis.Redis(host='localhost', port=6379, db=0)
-        self.pubsub = self.redis_client.pubsub()
+        self.logger = logging.getLogger('wormhole')
+        self.redis_pool = redis_pool or redis.ConnectionPool.from_url(os.getenv("REDIS_HOST_URL", "redis://localhost:6379"))
+        self.redis_client = redis.Redis(connection_pool=self.redis_pool)
+        self.inbound_channel = os.getenv("TOX_INBOUND_CHANNEL", "wormhole_channel")
+        self.channel = os.getenv("TOX_CHANNEL", "tox_node")
+        self.backoff_base = float(os.getenv("REDIS_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("REDIS_BACKOFF_MAX", "30"))
 
     async def start(self):
         self.logger.info("Starting Tox service")
-        self.pubsub.subscribe('wormhole_channel')
-        for message in self.pubsub.listen():
-            if message['type'] == 'message':
-                await self.handle_message(message['data'])
+        backoff = self.backoff_base
+        while True:
+            try:
+                async with self.redis_client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.inbound_channel)
+                    self.logger.info(f"Tox service subscribed to {self.inbound_channel}")
+                    backoff = self.backoff_base
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            await self.handle_message(message['data'])
+            except redis.RedisError as e:
+                self.logger.warning(f"Tox service lost its Redis subscription: {str(e)}")
+
+            delay = backoff * random.uniform(0.5, 1.5)
+            self.logger.info(f"Reconnecting Tox service in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, self.backoff_max)
 
     async def stop(self):
         self.logger.info("Stopping Tox service")
-        self.pubsub.unsubscribe()
-        self.redis_client.close()
+        # Only returns connections to the pool; whoever created a shared pool disconnects it
+        await self.redis_client.aclose()
 
     async def handle_message(self, message):
         try:
@@ -31,10 +57,10 @@ class ToxService:
             self.logger.error(f"Failed to decode message: {message}")
 
     async def send_to_tox(self, message):
-        self.redis_client.publish('tox_node', message)
+        await self.redis_client.publish(self.channel, message)
 
-    def receive_from_tox(self):
-        message = self.redis_client.get('tox_node')
+    async def receive_from_tox(self):
+        message = await self.redis_client.get(self.channel)
         if message:
             return json.loads(message)
-        return None
\ No newline at end of file
+        return None
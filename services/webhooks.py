@@ -0,0 +1,65 @@
+import asyncio
+import discord
+
+from typing import Dict
+from bot.config import WormholeConfig
+
+WEBHOOK_NAME = "WormholeWebhook"
+
+
+# Webhook ids and tokens are kept in the Webhooks table (mirrored in WormholeConfig.webhooks) and
+# turned into Webhook.partial objects, so the channel is only asked for its webhooks again when
+# Discord reports the stored one as gone (404) or its token as invalid (401).
+class WebhookRegistry:
+    def __init__(self, bot):
+        self.bot = bot
+        self.config: WormholeConfig = bot.config
+        self._partials: Dict[str, discord.Webhook] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def get(self, channel: discord.abc.GuildChannel) -> discord.Webhook:
+        channel_id = str(channel.id)
+        stored = self.config.get_webhook(channel_id)
+        if stored:
+            return self._partial(channel_id, *stored)
+
+        async with self._locks.setdefault(channel_id, asyncio.Lock()):
+            stored = self.config.get_webhook(channel_id)
+            if stored:
+                return self._partial(channel_id, *stored)
+
+            webhooks = await channel.webhooks()
+            webhook = discord.utils.find(lambda w: w.name == WEBHOOK_NAME and w.token, webhooks)
+            webhook = webhook or await channel.create_webhook(name=WEBHOOK_NAME)
+            await self.config.set_webhook(channel_id, webhook.id, webhook.token)
+            return self._partial(channel_id, webhook.id, webhook.token)
+
+    def _partial(self, channel_id: str, webhook_id: int, webhook_token: str) -> discord.Webhook:
+        webhook = self._partials.get(channel_id)
+        if not webhook or webhook.id != webhook_id:
+            webhook = discord.Webhook.partial(webhook_id, webhook_token, client=self.bot)
+            self._partials[channel_id] = webhook
+        return webhook
+
+    async def forget(self, channel_id: str) -> None:
+        self._partials.pop(channel_id, None)
+        await self.config.remove_webhook(channel_id)
+
+    async def send(self, channel: discord.abc.GuildChannel, **kwargs):
+        webhook = await self.get(channel)
+        try:
+            return await webhook.send(**kwargs)
+        except discord.HTTPException as e:
+            if e.status not in (401, 404):
+                raise
+        await self.forget(str(channel.id))
+        webhook = await self.get(channel)
+        return await webhook.send(**kwargs)
+
+    async def edit_message(self, channel: discord.abc.GuildChannel, message_id: int, **kwargs):
+        webhook = await self.get(channel)
+        return await webhook.edit_message(message_id, **kwargs)
+
+    async def delete_message(self, channel: discord.abc.GuildChannel, message_id: int):
+        webhook = await self.get(channel)
+        await webhook.delete_message(message_id)
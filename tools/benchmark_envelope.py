@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bot.utils.envelope import Envelope
+
+
+def sample_envelope(content_size: int, attachments: int) -> Envelope:
+    return Envelope(
+        username="Wormhole User",
+        user_hash="9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
+        content="x" * content_size,
+        category="wormhole",
+        attachments=[f"https://cdn.discordapp.com/attachments/1/{i}/image.png" for i in range(attachments)],
+        has_embeds=True,
+        origin="4b2c9a0e6f1d4e8aa1f3c5d7e9b0a2c4"
+    )
+
+
+def legacy_encode(envelope: Envelope) -> str:
+    # What redis_publish used to build for every message
+    return json.dumps({
+        "username": envelope.username,
+        "hash": envelope.user_hash,
+        "message": envelope.full_text() + ("<embed>" if envelope.has_embeds else "") + ("<sticker>" if envelope.has_stickers else "")
+    })
+
+
+def measure(name, func, arg, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {iterations / elapsed:12,.0f} ops/s   {elapsed / iterations * 1e6:8.2f} us/op")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare envelope codec throughput against the legacy json.dumps payload")
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--content-size", type=int, default=200)
+    parser.add_argument("--attachments", type=int, default=2)
+    args = parser.parse_args()
+
+    envelope = sample_envelope(args.content_size, args.attachments)
+    legacy = legacy_encode(envelope)
+    as_json = envelope.to_json()
+    as_binary = envelope.encode()
+
+    print(f"{args.iterations} iterations, {args.content_size} byte content, {args.attachments} attachment(s)")
+    # The legacy payload only carries username, hash and flattened text; the other two carry every field
+    print(f"payload size: legacy {len(legacy.encode('utf-8'))} B, envelope json {len(as_json.encode('utf-8'))} B, envelope binary {len(as_binary)} B")
+    measure("encode legacy json.dumps", legacy_encode, envelope, args.iterations)
+    measure("encode envelope json", Envelope.to_json, envelope, args.iterations)
+    measure("encode envelope binary", Envelope.encode, envelope, args.iterations)
+    measure("decode legacy json.loads", json.loads, legacy, args.iterations)
+    measure("decode envelope json", Envelope.decode, as_json.encode("utf-8"), args.iterations)
+    measure("decode envelope binary", Envelope.decode, as_binary, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bot.config import WormholeConfig
+
+
+async def legacy_pre_send(config: WormholeConfig, user_id: str, channel_id: str):
+    # The sequence of awaits on_message made before it could start sending
+    async with config.pool.acquire() as conn:
+        await conn.fetchval("SELECT EXISTS(SELECT 1 FROM BannedUsers WHERE user_id = $1)", user_id)
+        banned_id = await conn.fetchval(
+            "SELECT user_id FROM Users WHERE hash LIKE $1 || '%' ORDER BY LENGTH(hash) LIMIT 1", user_id
+        )
+        await conn.fetchval("SELECT EXISTS(SELECT 1 FROM BannedUsers WHERE user_id = $1)", banned_id)
+        await conn.fetchrow("SELECT * FROM Users WHERE user_id = $1", user_id)
+        await conn.fetchrow("SELECT * FROM Channels WHERE channel_id = $1", channel_id)
+        await conn.fetchrow("SELECT * FROM Channels WHERE channel_id = $1", channel_id)
+        await conn.fetchrow("SELECT * FROM Users WHERE user_id = $1", user_id)
+        user = await conn.fetchrow("SELECT * FROM Users WHERE user_id = $1", user_id)
+        await conn.fetchrow("SELECT color FROM Roles WHERE name = $1", user['role'])
+        await conn.fetch(
+            """
+            SELECT channel_id FROM Channels WHERE channel_category = (
+                SELECT channel_category FROM Channels WHERE channel_id = $1
+            )
+            """,
+            channel_id
+        )
+
+
+async def relay_context_cold(config: WormholeConfig, user_id: str, channel_id: str):
+    config.user_cache.clear()
+    await config.get_relay_context(user_id, channel_id)
+
+
+async def relay_context_warm(config: WormholeConfig, user_id: str, channel_id: str):
+    await config.get_relay_context(user_id, channel_id)
+
+
+async def measure(name, func, config, user_id, channel_id, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await func(config, user_id, channel_id)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    p50 = statistics.median(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:<24} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare on_message pre-send latency before and after get_relay_context")
+    parser.add_argument("user_id")
+    parser.add_argument("channel_id")
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    config = WormholeConfig()
+    await config.initialize()
+    await config.warm_caches()
+
+    print(f"{args.iterations} iterations per variant")
+    await measure("legacy (sequential)", legacy_pre_send, config, args.user_id, args.channel_id, args.iterations)
+    await measure("relay context (cold)", relay_context_cold, config, args.user_id, args.channel_id, args.iterations)
+    await measure("relay context (warm)", relay_context_warm, config, args.user_id, args.channel_id, args.iterations)
+
+    await config.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,122 +1,234 @@
+import argparse
+import asyncio
 import json
 import os
-import psycopg2
-from psycopg2.extras import Json
-
-from dotenv import load_dotenv
-load_dotenv()
-
-DB_PARAMS = {
-    "dbname": os.getenv("DB_NAME"),
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-    "host": os.getenv("DB_HOST"),
-    "port": os.getenv("DB_PORT")
-}
+import sys
+import time
 
-def connect_to_db():
-    return psycopg2.connect(**DB_PARAMS)
+import asyncpg
 
-def migrate_json_to_postgresql(json_file_path):
-    with open(json_file_path, 'r') as file:
-        data = json.load(file)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-    conn = connect_to_db()
-    cur = conn.cursor()
+from bot.config import WormholeConfig, create_tables, ensure_partitions
 
-    try:
-        cur.execute("""
-            INSERT INTO wormhole_config (admins, servers, channel_list, banned_servers, banned_users, banned_words, max_difficulty)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (
-            data.get('admins', []),
-            data.get('servers', []),
-            data.get('channel_list', []),
-            data.get('banned_servers', []),
-            data.get('banned_users', []),
-            data.get('banned_words', []),
-            data.get('max_difficulty', 10)
-        ))
+WHITESPACE = " \t\n\r"
+
+# Merge order matters: everything below Users references Users(user_id)
+TABLES = {
+    "Roles": (("name", "color"), "name"),
+    "ChannelList": (("channel_name",), "channel_name"),
+    "Channels": (("channel_id", "server_id", "channel_category", "react"), "channel_id"),
+    "Users": (("user_id", "hash", "role", "profile_picture", "difficulty", "difficulty_penalty", "can_send_message", "nonce"), "user_id"),
+    "Usernames": (("user_id", "name"), None),
+    "MessageHistory": (("hash", "user_id", "timestamp"), None),
+    "TempCommandMessageHistory": (("user_id", "content"), None),
+    "Admins": (("user_id",), "user_id"),
+    "BannedUsers": (("user_id",), "user_id"),
+    "BannedServers": (("server_id",), "server_id"),
+}
 
-        cur.execute("""
-            INSERT INTO content_filter (enabled, sensitivity)
-            VALUES (%s, %s)
-        """, (
-            data['content_filter']['enabled'],
-            data['content_filter']['sensitivity']
+
+class JsonStreamReader:
+    # Walks a JSON document incrementally so only one value (e.g. one user) is held in memory at a time
+
+    def __init__(self, file, chunk_size: int = 1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        # Read at least as much as is already buffered so re-parsing a large value stays linear
+        chunk = self.file.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos] if self.pos < len(self.buffer) else ""
+            self._fill()
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        while True:
+            self.peek()
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number or literal that ends exactly at the buffer edge may be truncated
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def iter_object(self):
+        # Yields each key; the caller must consume its value (value() or iter_object()) before the next one
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Expected ',' or '}}' at offset {self.pos - 1}")
+
+
+class BulkImporter:
+    def __init__(self, config: WormholeConfig, conn, batch_size: int):
+        self.config = config
+        self.conn = conn
+        self.batch_size = batch_size
+        self.rows = {table: [] for table in TABLES}
+        self.imported = {table: 0 for table in TABLES}
+        self.buffered = 0
+        self.started = time.monotonic()
+
+    async def prepare(self):
+        for table, (columns, _) in TABLES.items():
+            await self.conn.execute(
+                f"CREATE TEMP TABLE import_{table.lower()} AS SELECT {', '.join(columns)} FROM {table} WITH NO DATA"
+            )
+
+    async def add(self, table: str, row: tuple):
+        self.rows[table].append(row)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        for table, (columns, conflict_key) in TABLES.items():
+            rows = self.rows[table]
+            if not rows:
+                continue
+
+            if table == "MessageHistory":
+                timestamps = [row[2] for row in rows]
+                await ensure_partitions(self.conn, table, min(timestamps), max(timestamps) + 1, self.config.partition_span)
+
+            staging = f"import_{table.lower()}"
+            column_list = ", ".join(columns)
+            conflict = f"ON CONFLICT ({conflict_key}) DO NOTHING" if conflict_key else "ON CONFLICT DO NOTHING"
+            async with self.conn.transaction():
+                await self.conn.copy_records_to_table(staging, records=rows, columns=columns)
+                await self.conn.execute(f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} {conflict}")
+                await self.conn.execute(f"TRUNCATE {staging}")
+
+            self.imported[table] += len(rows)
+            self.rows[table] = []
+
+        self.buffered = 0
+        self.report()
+
+    def report(self):
+        total = sum(self.imported.values())
+        elapsed = time.monotonic() - self.started
+        rate = total / elapsed if elapsed else 0
+        print(f"{total} rows in {elapsed:.1f}s ({rate:,.0f} rows/sec) - " +
+              ", ".join(f"{table}: {count}" for table, count in self.imported.items() if count))
+
+
+async def import_users(reader: JsonStreamReader, importer: BulkImporter, user_ids: set):
+    for user_id in reader.iter_object():
+        user = reader.value()
+        user_ids.add(user_id)
+        await importer.add("Users", (
+            user_id,
+            user.get('hash') or await importer.config.compute_user_hash(user_id),
+            user.get('role', 'user'),
+            user.get('profile_picture') or None,
+            float(user.get('difficulty', 0)),
+            float(user.get('difficulty_penalty', 0)),
+            user.get('can_send_message', True),
+            int(user.get('nonce', 0))
         ))
+        for name in user.get('names', []):
+            await importer.add("Usernames", (user_id, name))
+        for message in user.get('message_history', []):
+            await importer.add("MessageHistory", (message['hash'], user_id, float(message['timestamp'])))
+        for message in user.get('temp_command_message_history', []):
+            await importer.add("TempCommandMessageHistory", (user_id, message['content']))
 
-        for channel_name, channel_data in data.get('channels', {}).items():
-            for channel_id, channel_config in channel_data.items():
-                cur.execute("""
-                    INSERT INTO channels (channel_id, name, react)
-                    VALUES (%s, %s, %s)
-                """, (
-                    int(channel_id),
-                    channel_name,
-                    channel_config.get('react', False)
-                ))
-
-        for role_name, role_data in data.get('roles', {}).items():
-            cur.execute("""
-                INSERT INTO roles (name, color, permissions)
-                VALUES (%s, %s, %s)
-            """, (
-                role_name,
-                role_data['color'],
-                role_data.get('permissions', [])
-            ))
-
-        for user_id, user_data in data.get('users', {}).items():
-            cur.execute("""
-                INSERT INTO users (discord_id, hash, role, names, profile_picture, difficulty, difficulty_penalty, can_send_message, nonce)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                int(user_id),
-                user_data['hash'],
-                user_data['role'],
-                user_data.get('names', []),
-                user_data.get('profile_picture', ''),
-                user_data.get('difficulty', 0),
-                user_data.get('difficulty_penalty', 0),
-                user_data.get('can_send_message', True),
-                user_data.get('nonce', 0)
-            ))
-
-            cur.execute("SELECT id FROM users WHERE discord_id = %s", (int(user_id),))
-            user_db_id = cur.fetchone()[0]
-
-            for msg in user_data.get('message_history', []):
-                cur.execute("""
-                    INSERT INTO message_history (user_id, timestamp, hash)
-                    VALUES (%s, %s, %s)
-                """, (
-                    user_db_id,
-                    msg['timestamp'],
-                    msg['hash']
-                ))
-
-            for msg in user_data.get('temp_command_message_history', []):
-                cur.execute("""
-                    INSERT INTO temp_command_message_history (user_id, role, content)
-                    VALUES (%s, %s, %s)
-                """, (
-                    user_db_id,
-                    msg['role'],
-                    msg['content']
-                ))
-
-        conn.commit()
-        print("Migration completed successfully!")
 
-    except Exception as e:
-        conn.rollback()
-        print(f"An error occurred during migration: {e}")
+async def migrate_json_to_postgresql(json_file_path: str, batch_size: int):
+    config = WormholeConfig()
+    config.pool = await asyncpg.create_pool(config.db_url)
+    await create_tables(config.pool)
 
+    user_ids = set()
+    admins = []
+    try:
+        async with config.pool.acquire() as conn:
+            importer = BulkImporter(config, conn, batch_size)
+            await importer.prepare()
+
+            with open(json_file_path, "r") as file:
+                reader = JsonStreamReader(file)
+                for key in reader.iter_object():
+                    if key == "users":
+                        await import_users(reader, importer, user_ids)
+                        continue
+
+                    value = reader.value()
+                    if key == "admins":
+                        # Admins reference Users, which may appear later in the file
+                        admins = [str(admin) for admin in value]
+                    elif key == "channel_list":
+                        for channel_name in value:
+                            await importer.add("ChannelList", (channel_name,))
+                    elif key == "channels":
+                        for channel_name, channels in value.items():
+                            await importer.add("ChannelList", (channel_name,))
+                            for channel_id, channel_config in channels.items():
+                                await importer.add("Channels", (
+                                    str(channel_id),
+                                    str(channel_config.get('server_id', '0')),
+                                    channel_name,
+                                    channel_config.get('react', False)
+                                ))
+                    elif key == "roles":
+                        for role_name, role in value.items():
+                            await importer.add("Roles", (role_name, role['color']))
+                    elif key == "banned_users":
+                        for user_id in value:
+                            await importer.add("BannedUsers", (str(user_id),))
+                    elif key == "banned_servers":
+                        for server_id in value:
+                            await importer.add("BannedServers", (int(server_id),))
+
+            for admin in admins:
+                if admin in user_ids:
+                    await importer.add("Admins", (admin,))
+                else:
+                    print(f"Skipping admin {admin}: no matching user")
+
+            await importer.flush()
+        print("Migration completed successfully!")
     finally:
-        cur.close()
-        conn.close()
+        await config.pool.close()
+
 
 if __name__ == "__main__":
-    json_file_path = "config.json"
-    migrate_json_to_postgresql(json_file_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Import a legacy config.json into the Wormhole database")
+    parser.add_argument("json_file_path", nargs="?", default="config.json")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    args = parser.parse_args()
+    asyncio.run(migrate_json_to_postgresql(args.json_file_path, args.batch_size))